@@ -53,13 +53,11 @@ def main(experiment):
         Path(config["path"]["data"]) / "processed" / experimental_settings.get("key")
     )
 
-    users = pd.read_json(
-        processed_path / "consolidated" / "user.consolidated_groups.parquet", lines=True
+    users = pd.read_parquet(
+        processed_path / "consolidated" / "user.consolidated_groups.parquet"
     )
 
-    rts = pd.read_json(
-        processed_path / "user.retweet_edges.all.parquet", lines=True
-    ).pipe(
+    rts = pd.read_parquet(processed_path / "user.retweet_edges.all.parquet").pipe(
         lambda x: x[
             x["user.id"].isin(users["user.id"]) & x["rt.user.id"].isin(users["user.id"])
         ]
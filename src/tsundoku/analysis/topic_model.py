@@ -1,6 +1,4 @@
 import logging
-import gzip
-import rapidjson as json
 import click
 import dask
 import dask.dataframe as dd
@@ -17,7 +15,7 @@ from pathlib import Path
 from scipy.sparse import load_npz
 from cytoolz import keymap, valmap
 
-from tsundoku.utils.files import read_toml
+from tsundoku.utils.files import read_toml, write_parquet
 
 
 @click.command()
@@ -87,19 +85,19 @@ def main(experiment):
     # with open(Path(config["path"]["config"]) / "groups" / f"{group_key}.toml") as f:
     #    group_config = toml.load(f)
 
-    users = pd.read_json(
-        processed_path / "consolidated" / "user.consolidated_groups.parquet", lines=True
+    users = pd.read_parquet(
+        processed_path / "consolidated" / "user.consolidated_groups.parquet"
     )
     users.head()
 
     docterm_matrix = load_npz(processed_path / "user.tweets.matrix.npz")
 
-    vocabulary = pd.read_json(
-        processed_path / "user.tweet_vocabulary.relevant.parquet", lines=True
+    vocabulary = pd.read_parquet(
+        processed_path / "user.tweet_vocabulary.relevant.parquet"
     )
 
-    frequencies = pd.read_json(
-        processed_path / "consolidated" / "tweet.word_frequencies.parquet", lines=True
+    frequencies = pd.read_parquet(
+        processed_path / "consolidated" / "tweet.word_frequencies.parquet"
     )
 
     frequent_vocabulary = vocabulary.join(
@@ -151,35 +149,36 @@ def main(experiment):
 
     lda.save(str(processed_path / "consolidated" / f"user.topic_model.gensim.gz"))
 
-    frequent_vocabulary.rename(
-        {"index": "topic_term_id", "token_id": "dtm_col_id"}, axis=1
-    ).assign(row_id=np.arange(len(frequent_vocabulary))).drop(
-        ["frequency", "n_users"], axis=1
-    ).to_json(
+    write_parquet(
+        frequent_vocabulary.rename(
+            {"index": "topic_term_id", "token_id": "dtm_col_id"}, axis=1
+        )
+        .assign(row_id=np.arange(len(frequent_vocabulary)))
+        .drop(["frequency", "n_users"], axis=1)
+        .reset_index(drop=True),
         processed_path / "consolidated" / "user.topic_model.vocabulary.parquet",
-        compression="gzip",
-        orient="records",
-        lines=True,
     )
 
-    with gzip.open(
-        processed_path / "consolidated" / "user.topic_model.doc_topics.parquet", "wt"
-    ) as f:
-        for i, (doc, uid) in enumerate(
-            zip(
-                gensim.matutils.Sparse2Corpus(
-                    docterm_matrix[:, frequent_vocabulary["token_id"].values],
-                    documents_columns=False,
-                ),
-                users["user.id"].values,
-            )
-        ):
-            record = {"row_id": i, "user.id": int(uid)}
-            record.update(
-                valmap(float, keymap(str, dict(lda.get_document_topics(doc))))
-            )
-            json.dump(record, f)
-            f.write("\n")
+    doc_topics = []
+
+    for i, (doc, uid) in enumerate(
+        zip(
+            gensim.matutils.Sparse2Corpus(
+                docterm_matrix[:, frequent_vocabulary["token_id"].values],
+                documents_columns=False,
+            ),
+            users["user.id"].values,
+        )
+    ):
+        record = {"row_id": i, "user.id": int(uid)}
+        record.update(valmap(float, keymap(str, dict(lda.get_document_topics(doc)))))
+        doc_topics.append(record)
+
+    # topics that are not assigned to a document are missing values
+    write_parquet(
+        pd.DataFrame(doc_topics),
+        processed_path / "consolidated" / "user.topic_model.doc_topics.parquet",
+    )
 
 
 if __name__ == "__main__":
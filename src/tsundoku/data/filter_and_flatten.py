@@ -2,13 +2,19 @@
 import click
 import logging
 import glob
-import rapidjson as json
+import orjson
 import os
 import os.path
 import gzip
 import zlib
 import dask
 
+try:
+    # ISA-L's gzip is several times faster than zlib's at compressing
+    from isal import igzip as gzip_writer
+except ImportError:
+    gzip_writer = gzip
+
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 from multiprocessing.pool import ThreadPool
@@ -47,7 +53,8 @@ def main():
         total_tweets = 0
 
         try:
-            with gzip.open(target_file, "wt") as dst:
+            # these files are converted to parquet later, so we favor speed over size
+            with gzip_writer.open(target_file, "wb", compresslevel=1) as dst:
                 with gzip.open(source_file, "r") as src:
                     for tweet in iterate_tweets(src):
                         total_tweets += 1
@@ -56,7 +63,7 @@ def main():
 
                         # print(tweet["lang"], tweet["text"])
                         # break
-                        dst.write(f"{json.dumps(tweet, ensure_ascii=False)}\n")
+                        dst.write(orjson.dumps(tweet, option=orjson.OPT_APPEND_NEWLINE))
                         written_tweets += 1
 
             full_size = os.stat(target_file).st_size / 1024 / 1024
@@ -1,368 +1,751 @@
-import logging
-import re
-import zlib
-from functools import lru_cache
-from itertools import chain
-from multiprocessing.pool import ThreadPool
-from pathlib import Path
-
-import ahocorasick
-import dask
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
-import pytz
-import toml
-from cytoolz import pluck
-from pyarrow import json
-
-from tsundoku.utils.dates import twitter_date_format
-from tsundoku.utils.files import read_list, write_parquet
-from tsundoku.utils.re import build_re_from_files
-from tsundoku.utils.text import tokenize
-
-
-class TweetImporter(object):
-    def __init__(self, config_file):
-        self.config_file = config_file
-        self.config = None
-        self.logger = logging.getLogger(__name__)
-
-        with open(self.config_file, "rt") as f:
-            self.config = toml.load(f)["project"]
-
-        logging.info(self.config)
-
-        self.configure_accounts()
-        self.configure_locations()
-        self.configure_language()
-        self.configure_terms()
-        self.configure_tokenizer()
-
-        self.timezone = pytz.timezone(self.config["content"].get("timezone"))
-        dask.config.set(
-            pool=ThreadPool(int(self.config["environment"].get("n_jobs", 1)))
-        )
-
-    def filter_dataframe(self, df):
-        flag = df["id"].notna()
-
-        if not self.location["accept_unknown"]:
-            if self.location["patterns"]:
-                flag = flag & (
-                    df["user.location"].str.contains(self.location["patterns"]) == True
-                )
-
-        if self.location["blacklist"]:
-            flag = flag & ~(
-                df["user.location"].str.contains(self.location["blacklist"]) == True
-            )
-
-        if self.account_ids:
-            flag = flag | df["user.id"].isin(self.account_ids)
-
-        candidates = df[flag].assign(
-            tmpwhitelisted=lambda x: x["user.id"].isin(self.account_ids)
-        )
-        # self.logger.info(f"Location filtering: {len(candidates)} from {len(df)} tweets")
-
-        if len(self.automaton):
-            result = []
-            for tuple in candidates.itertuples():
-                # allowed users
-                if getattr(tuple, "tmpwhitelisted"):
-                    result.append(True)
-                    continue
-
-                # print(getattr(tuple, 'text'))
-                findings = set(
-                    pluck(1, self.automaton.iter(getattr(tuple, "text").lower()))
-                )
-                # print(findings)
-
-                if self.terms["patterns"] is not None:
-                    # we have keywords:
-                    result.append(
-                        "search-term" in findings and not "rejected-term" in findings
-                    )
-                else:
-                    result.append(not "rejected-term" in findings)
-
-            candidates = candidates[result]
-
-        # self.logger.info(f"Keyword filtering: {len(candidates)} from {len(df)} tweets")
-
-        return candidates.drop("tmpwhitelisted", axis=1)
-
-    def read_tweet_dataframe(self, filename):
-        adf = pd.read_parquet(filename, engine="pyarrow")
-
-        if len(adf.columns) != 0:
-            return self.filter_dataframe(adf)
-
-        return adf
-
-    def configure_accounts(self):
-        self.account_ids = set(self.config["content"].get("account_ids", []))
-
-    def configure_locations(self):
-        location_config = self.config["content"].get("location", {})
-        self.location = {}
-        self.location["accept_unknown"] = bool(location_config.get("accept_unknown", 1))
-
-        if location_config is not None and "blacklist" in location_config:
-            blacklist_files = map(
-                lambda x: self.config["path"].get("config") + "/" + x,
-                location_config["blacklist"],
-            )
-            patterns = list(
-                map(
-                    lambda x: x.split(";")[0],
-                    filter(lambda x: x, chain(*map(read_list, blacklist_files))),
-                )
-            )
-            self.location["blacklist"] = re.compile("|".join(patterns), re.IGNORECASE)
-        else:
-            self.logger.warning("no blacklisted locations used")
-            self.location["blacklist"] = None
-
-        if location_config is not None and "gazetteers" in location_config:
-            gazetteers = map(
-                lambda x: self.config["path"].get("config") + "/" + x,
-                location_config["gazetteers"],
-            )
-            patterns = list(
-                map(
-                    lambda x: x.split(";")[0],
-                    filter(lambda x: x, chain(*map(read_list, gazetteers))),
-                )
-            )
-            self.location["patterns"] = re.compile("|".join(patterns), re.IGNORECASE)
-        else:
-            self.logger.warning("no location filters used")
-            self.location["patterns"] = None
-
-    def configure_terms(self):
-        self.automaton = ahocorasick.Automaton()
-
-        term_files = self.config["content"].get("term_files", None)
-        self.terms = {}
-
-        if term_files is not None:
-            term_files = list(
-                map(lambda x: self.config["path"].get("config") + "/" + x, term_files)
-            )
-            self.terms["patterns"] = []  # build_re_from_files(term_files)
-            for filename in term_files:
-                terms = read_list(filename)
-                self.terms["patterns"].extend(terms)
-                for term in terms:
-                    self.automaton.add_word(term.strip(), "search-term")
-                self.logger.info(f"read keywords from {filename}: {terms}")
-        else:
-            self.logger.warning("no keyword terms used")
-            self.terms["patterns"] = None
-
-        blacklist = self.config["content"].get("blacklist_files", None)
-
-        if blacklist is None:
-            self.logger.warning("no blacklisted keywords used")
-            self.terms["blacklist"] = None
-        else:
-            blacklist = map(
-                lambda x: self.config["path"].get("config") + "/" + x, blacklist
-            )
-            self.terms["blacklist"] = []  # build_re_from_files(blacklist)
-
-            for filename in blacklist:
-                terms = read_list(filename)
-                self.terms["blacklist"].extend(terms)
-                for term in terms:
-                    self.automaton.add_word(term, "rejected-term")
-                self.logger.info(f"read blacklisted keywords from {filename}: {terms}")
-
-        blacklist_urls = self.config.get("blacklist_urls", None)
-
-        if blacklist_urls is not None:
-            blacklist_urls = map(
-                lambda x: self.config["path"].get("config") + "/" + x, blacklist_urls
-            )
-            self.terms["blacklist_urls"] = build_re_from_files(blacklist_urls)
-        else:
-            self.logger.warning("no blacklisted URLs")
-
-        self.automaton.make_automaton()
-
-    def configure_language(self):
-        self.languages = self.config["content"].get("accepted_lang", None)
-
-    def configure_tokenizer(self):
-        dtm_config = self.config["content"].get("user_matrix", {})
-        ngram_range = dtm_config.get("ngram_range", None)
-        stopwords_file = dtm_config.get("stopwords_file", None)
-
-        if stopwords_file is not None:
-            stopwords_file = self.config["path"].get("config") + "/" + stopwords_file
-            self.logger.info(f"stopwords file: {stopwords_file}")
-
-        if stopwords_file is None:
-            stopwords = set()
-            self.logger.info("no stopwords")
-        else:
-            stopwords = set(read_list(stopwords_file))
-            self.logger.info(f"#stopwords: {len(stopwords)}")
-
-        @lru_cache(maxsize=dtm_config.get("lru_size", 50))
-        def _tokenize(x):
-            return tokenize(x, ngram_range=ngram_range, stopwords=stopwords)
-
-        self.tokenize = _tokenize
-
-    def data_path(self):
-        return Path(self.config["path"].get("data"))
-
-    def parse_date_data_to_parquet(
-        self, date, pattern, source_path, target_path, periods=24 * 6, freq="10t"
-    ):
-        date = pd.to_datetime(date)
-
-        if type(source_path) == str:
-            source_path = Path(source_path)
-        elif not isinstance(source_path, Path):
-            raise ValueError(
-                f"source_path is not a valid object (Path or str needed, got {type(source_path)})"
-            )
-
-        if not source_path.exists():
-            raise ValueError(f"source_path ({source_path}) is not a valid path")
-
-        self.logger.info(f"Source folder: {source_path}")
-
-        if not source_path.exists():
-            raise IOError(f"{source_path} does not exist")
-
-        data_date = self.timezone.localize(date).astimezone(pytz.utc)
-        self.logger.info(f"UTC start date: {data_date}")
-
-        task_files = []
-
-        for date in pd.date_range(data_date, periods=periods, freq=freq):
-            file_path = source_path / pattern.format(date.strftime("%Y%m%d%H%M"))
-
-            if not file_path.exists():
-                self.logger.info(f"{file_path} does not exist")
-            else:
-                task_files.append(file_path)
-
-        self.logger.info(f"#files to transform: {len(task_files)}")
-
-        read_tweets = self.import_parquet_files(task_files, target_path)
-        return read_tweets
-
-    def import_parquet_files(self, file_names, target_path):
-        if not target_path.exists():
-            target_path.mkdir(parents=True)
-            self.logger.info("{} directory created".format(target_path))
-        else:
-            self.logger.info("{} exists".format(target_path))
-
-        tasks = [
-            dask.delayed(self._parse_files_to_parquet)(i, f, target_path)
-            for i, f in enumerate(file_names)
-        ]
-        read_tweets = sum(dask.compute(*tasks))
-        self.logger.info(f"done! imported {read_tweets} tweets from {len(file_names)}")
-        return read_tweets
-
-    def _parse_files_to_parquet(self, i, filename, target_path):
-        try:
-            df = json.read_json(filename)
-        except zlib.error:
-            self.logger.error(f"ZLIB EXCEPTION - (#{i}) corrupted file: {filename}")
-            return 0
-        except pa.lib.ArrowInvalid:
-            self.logger.error(f"PYARROW EXCEPTION - (#{i}) corrupted file: {filename}")
-            return 0
-
-        target_file = target_path / f"{Path(filename).stem}.parquet"
-
-        pq.write_table(df, target_file, use_dictionary=False)
-        return df.num_rows
-
-    def import_date(self, date, pattern, source_path, periods=24 * 6, freq="10t"):
-        date_str = date
-        date = pd.to_datetime(date)
-
-        if type(source_path) == str:
-            source_path = Path(source_path)
-        elif not isinstance(source_path, Path):
-            raise ValueError(
-                f"source_path is not a valid object (Path or str needed, got {type(source_path)})"
-            )
-
-        if not source_path.exists():
-            raise ValueError(f"source_path ({source_path}) is not a valid path")
-
-        self.logger.info(f"Source folder: {source_path}")
-
-        if not source_path.exists():
-            raise IOError(f"{source_path} does not exist")
-
-        data_date = self.timezone.localize(date).astimezone(pytz.utc)
-        self.logger.info(f"UTC start date: {data_date}")
-
-        task_files = []
-
-        for date in pd.date_range(data_date, periods=periods, freq=freq):
-            file_path = source_path / pattern.format(date.strftime("%Y%m%d%H%M"))
-
-            if not file_path.exists():
-                self.logger.info(f"{file_path} does not exist")
-                pass
-            else:
-                task_files.append(file_path)
-
-        self.logger.info(f"#files to import: {len(task_files)}")
-
-        parquet_path = self.data_path() / "raw" / date_str
-
-        imported_tweets = self.import_files(
-            task_files, parquet_path, file_prefix="tweets.partition"
-        )
-        return imported_tweets
-
-    def import_files(self, file_names, target_path, file_prefix=None):
-        if not target_path.exists():
-            target_path.mkdir(parents=True)
-            self.logger.info("{} directory created".format(target_path))
-        else:
-            self.logger.info("{} exists".format(target_path))
-
-        tasks = [
-            dask.delayed(self._read_parquet_file)(
-                i, f, target_path, file_prefix=file_prefix
-            )
-            for i, f in enumerate(file_names)
-        ]
-        read_tweets = sum(dask.compute(*tasks))
-        self.logger.info(f"done! imported {read_tweets} tweets")
-        return read_tweets
-
-    def _read_parquet_file(self, i, filename, target_path, file_prefix=None):
-        df = self.read_tweet_dataframe(filename)
-
-        if file_prefix is not None:
-            target_file = target_path / f"{file_prefix}.{i}.parquet"
-        else:
-            target_file = target_path / f"{Path(filename).stem}.{i}.parquet"
-
-        df["tweet.tokens"] = df["text"].map(self.tokenize)
-        df["user.description_tokens"] = df["user.description"].map(self.tokenize)
-        df["user.name_tokens"] = df["user.name"].map(self.tokenize)
-        # we transform dates from format Sat Jan 01 11:27:55 +0000 2022 to datetime object
-        df["created_at"] = pd.to_datetime(df["created_at"], format=twitter_date_format)
-        df["user.created_at"] = pd.to_datetime(
-            df["user.created_at"], format=twitter_date_format
-        )
-        write_parquet(df, target_file)
-        return len(df)
+import logging
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from pathlib import Path
+
+import ahocorasick
+import dask
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytz
+import toml
+from pyarrow import json
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+from tsundoku.utils.dates import twitter_date_format
+from tsundoku.utils.files import prefetch_files, read_list, write_table
+from tsundoku.utils.re import build_re_from_files
+from tsundoku.utils.text import tokenize
+
+# above this number of terms the regex alternation gets slower than the automaton
+MAX_REGEX_TERMS = 1000
+# values stored in the automaton and hyperscan ids for each kind of term
+SEARCH_TERM = 0
+REJECTED_TERM = 1
+REGEX_METACHARACTERS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+# RE2 (used by Arrow) only knows ASCII for these escapes, while Python's re is Unicode
+# aware: RE2 never matches r"\bñuñoa\b" in "Ñuñoa, Chile"
+ASCII_ONLY_RE2_ESCAPES = re.compile(r"(?<!\\)(?:\\\\)*\\[bBdDsSwW]")
+
+
+def compile_terms(terms):
+    if not terms:
+        # a pattern that never matches (also understood by RE2)
+        return re.compile(r"[^\s\S]")
+
+    return re.compile("|".join(map(re.escape, terms)))
+
+
+def is_re2_compatible(pattern):
+    """
+    Returns True if Arrow's RE2 kernels compile the pattern and match the same
+    strings as Python's re would.
+    """
+    if ASCII_ONLY_RE2_ESCAPES.search(pattern):
+        return False
+
+    try:
+        pc.match_substring_regex(pa.array([""]), pattern, ignore_case=True)
+    except pa.ArrowInvalid:
+        return False
+
+    return True
+
+
+def build_literal_automaton(patterns):
+    """
+    Returns an automaton matching the (lowercased) patterns, or None if any of them
+    uses regex syntax.
+    """
+    if not patterns or any(REGEX_METACHARACTERS.search(p) for p in patterns):
+        return None
+
+    automaton = ahocorasick.Automaton()
+
+    for pattern in patterns:
+        automaton.add_word(pattern.lower(), True)
+
+    automaton.make_automaton()
+    return automaton
+
+
+def compile_hyperscan_database(search_terms, reject_terms):
+    expressions = [re.escape(t).encode("utf-8") for t in search_terms + reject_terms]
+    ids = [SEARCH_TERM] * len(search_terms) + [REJECTED_TERM] * len(reject_terms)
+
+    database = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    database.compile(
+        expressions=expressions,
+        ids=ids,
+        elements=len(expressions),
+        flags=[hyperscan.HS_FLAG_SINGLEMATCH] * len(expressions),
+    )
+    return database
+
+
+class TweetImporter(object):
+    def __init__(self, config_file):
+        self.config_file = config_file
+        self.config = None
+        self.logger = logging.getLogger(__name__)
+
+        with open(self.config_file, "rt") as f:
+            self.config = toml.load(f)["project"]
+
+        logging.info(self.config)
+
+        self.configure_accounts()
+        self.configure_locations()
+        self.configure_language()
+        self.configure_terms()
+        self.configure_tokenizer()
+
+        self.timezone = pytz.timezone(self.config["content"].get("timezone"))
+        self.n_jobs = int(self.config["environment"].get("n_jobs", 1))
+
+    def filter_dataframe(self, df, match_terms=True):
+        """
+        Applies the location lists that were not pushed down into the parquet scan
+        (see location_filter), and then the keyword filter.
+        """
+        engines = self.location["engines"]
+        flag = df["id"].notna().to_numpy(copy=True)
+
+        if not self.location["accept_unknown"]:
+            if engines.get("patterns", "arrow") != "arrow":
+                flag &= self.match_locations(df["user.location"], "patterns")
+
+        if engines.get("blacklist", "arrow") != "arrow":
+            # only the rows that are still accepted need to be scanned again
+            accepted = flag.nonzero()[0]
+            rejected = self.match_locations(
+                df["user.location"].iloc[accepted], "blacklist"
+            )
+            flag[accepted[rejected]] = False
+
+        if self.account_ids:
+            flag |= df["user.id"].isin(self.account_ids).to_numpy()
+
+        return self.filter_candidates(df[flag], match_terms=match_terms)
+
+    def match_locations(self, locations, key):
+        if self.location["engines"][key] == "pandas":
+            # object dtype keeps pandas on Python's re: arrow-backed strings would be
+            # matched with RE2, which is exactly what these patterns cannot use
+            matches = locations.astype(object).str.contains(self.location[key])
+            return (matches == True).to_numpy()
+
+        # literal patterns: a single Aho-Corasick sweep per location
+        automaton_iter = self.location["automata"][key].iter
+        return np.array(
+            [
+                isinstance(location, str) and any(automaton_iter(location.lower()))
+                for location in locations
+            ],
+            dtype=bool,
+        )
+
+    def location_filter(self):
+        """
+        Returns the location lists matched with Arrow as an expression, so they are
+        evaluated with RE2 kernels while the parquet file is being scanned. The other
+        lists are applied by filter_dataframe.
+        """
+        engines = self.location["engines"]
+        location = pc.field("user.location")
+        expression = pc.is_valid(pc.field("id"))
+
+        if not self.location["accept_unknown"]:
+            if engines.get("patterns") == "arrow":
+                expression = expression & pc.coalesce(
+                    pc.match_substring_regex(
+                        location, self.location["patterns"].pattern, ignore_case=True
+                    ),
+                    pc.scalar(False),
+                )
+
+        if engines.get("blacklist") == "arrow":
+            expression = expression & ~pc.coalesce(
+                pc.match_substring_regex(
+                    location, self.location["blacklist"].pattern, ignore_case=True
+                ),
+                pc.scalar(False),
+            )
+
+        if self.account_ids:
+            expression = expression | pc.field("user.id").isin(list(self.account_ids))
+
+        return expression
+
+    def terms_filter(self):
+        """
+        Returns the keyword filter of filter_candidates as an Arrow expression, so
+        rejected tweets are discarded while the parquet file is being scanned.
+        """
+        text = pc.utf8_lower(pc.field("text"))
+        expression = ~pc.coalesce(
+            pc.match_substring_regex(text, self.terms["reject_re"].pattern),
+            pc.scalar(False),
+        )
+
+        if self.terms["patterns"] is not None:
+            expression = expression & pc.coalesce(
+                pc.match_substring_regex(text, self.terms["search_re"].pattern),
+                pc.scalar(False),
+            )
+
+        if self.account_ids:
+            expression = expression | pc.field("user.id").isin(list(self.account_ids))
+
+        return expression
+
+    def filter_candidates(self, df, match_terms=True):
+        candidates = df.assign(
+            tmpwhitelisted=lambda x: x["user.id"].isin(self.account_ids)
+        )
+        # self.logger.info(f"Location filtering: {len(candidates)} from {len(df)} tweets")
+
+        if match_terms and len(self.automaton):
+            texts = candidates["text"].fillna("").str.lower()
+            accepted = self.match_terms(texts)
+            candidates = candidates[candidates["tmpwhitelisted"].to_numpy() | accepted]
+
+        # self.logger.info(f"Keyword filtering: {len(candidates)} from {len(df)} tweets")
+
+        return candidates.drop("tmpwhitelisted", axis=1)
+
+    def match_terms(self, texts):
+        """
+        Returns a boolean array telling which (lowercased) texts contain at least one
+        search term (if any) and no rejected terms.
+        """
+        if self.terms["search_re"] is not None:
+            accepted = np.ones(len(texts), dtype=bool)
+
+            if self.terms["patterns"] is not None:
+                accepted &= texts.str.contains(
+                    self.terms["search_re"], regex=True, na=False
+                ).to_numpy()
+
+            if self.terms["reject_re"] is not None:
+                accepted &= ~texts.str.contains(
+                    self.terms["reject_re"], regex=True, na=False
+                ).to_numpy()
+
+            return accepted
+
+        if self.terms["database"] is not None:
+            return self._match_terms_hyperscan(texts)
+
+        # too many terms for a regex and no hyperscan: fall back to the automaton
+        automaton_iter = self.automaton.iter
+        rows = []
+        kinds = []
+        append_row = rows.append
+        append_kind = kinds.append
+
+        for row, text in enumerate(texts.tolist()):
+            for _, kind in automaton_iter(text):
+                append_row(row)
+                append_kind(kind)
+
+        return self._assemble_terms_mask(len(texts), rows, kinds)
+
+    def _match_terms_hyperscan(self, texts):
+        database = self.terms["database"]
+        scan = database.scan
+        # scratch space cannot be shared between threads
+        scratch = hyperscan.Scratch(database)
+        rows = []
+        kinds = []
+        append_row = rows.append
+        append_kind = kinds.append
+
+        def on_match(kind, start, end, flags, row):
+            append_row(row)
+            append_kind(kind)
+            # a rejected term settles the outcome, stop scanning
+            return kind == REJECTED_TERM
+
+        for row, text in enumerate(texts.tolist()):
+            try:
+                scan(
+                    text.encode("utf-8"),
+                    match_event_handler=on_match,
+                    context=row,
+                    scratch=scratch,
+                )
+            except hyperscan.ScanTerminated:
+                pass
+
+        return self._assemble_terms_mask(len(texts), rows, kinds)
+
+    def _assemble_terms_mask(self, n_texts, rows, kinds):
+        # the hits are (row, kind) pairs, the mask is assembled with NumPy
+        rows = np.array(rows, dtype=np.int64)
+        kinds = np.array(kinds, dtype=np.int8)
+
+        if self.terms["patterns"] is not None:
+            result = np.zeros(n_texts, dtype=bool)
+            result[rows[kinds == SEARCH_TERM]] = True
+        else:
+            result = np.ones(n_texts, dtype=bool)
+
+        result[rows[kinds == REJECTED_TERM]] = False
+        return result
+
+    def read_tweet_dataframe(self, filename):
+        if len(pq.read_schema(filename)) == 0:
+            return pq.read_table(filename).to_pandas()
+
+        # rows rejected by the Arrow filters are discarded while scanning, before
+        # building any pandas object. the other filters run on the remaining rows
+        expression = self.location["filter"]
+
+        if self.terms["filter"] is not None:
+            expression = expression & self.terms["filter"]
+
+        table = pq.read_table(filename, filters=expression)
+        return self.filter_dataframe(
+            table.to_pandas(), match_terms=self.terms["filter"] is None
+        )
+
+    def configure_accounts(self):
+        self.account_ids = set(self.config["content"].get("account_ids", []))
+
+    def configure_locations(self):
+        location_config = self.config["content"].get("location", {})
+        self.location = {}
+        self.location["accept_unknown"] = bool(location_config.get("accept_unknown", 1))
+        # literal lists are matched with an Aho-Corasick automaton
+        self.location["automata"] = {}
+
+        if location_config is not None and "blacklist" in location_config:
+            blacklist_files = map(
+                lambda x: self.config["path"].get("config") + "/" + x,
+                location_config["blacklist"],
+            )
+            patterns = list(
+                map(
+                    lambda x: x.split(";")[0],
+                    filter(lambda x: x, chain(*map(read_list, blacklist_files))),
+                )
+            )
+            self.location["blacklist"] = re.compile("|".join(patterns), re.IGNORECASE)
+            self.location["automata"]["blacklist"] = build_literal_automaton(patterns)
+        else:
+            self.logger.warning("no blacklisted locations used")
+            self.location["blacklist"] = None
+
+        if location_config is not None and "gazetteers" in location_config:
+            gazetteers = map(
+                lambda x: self.config["path"].get("config") + "/" + x,
+                location_config["gazetteers"],
+            )
+            patterns = list(
+                map(
+                    lambda x: x.split(";")[0],
+                    filter(lambda x: x, chain(*map(read_list, gazetteers))),
+                )
+            )
+            self.location["patterns"] = re.compile("|".join(patterns), re.IGNORECASE)
+            self.location["automata"]["patterns"] = build_literal_automaton(patterns)
+        else:
+            self.logger.warning("no location filters used")
+            self.location["patterns"] = None
+
+        # each list gets its own engine: the automaton for literal lists, RE2 pushed
+        # down into the parquet scan for regexes that RE2 matches exactly like
+        # Python's re (see is_re2_compatible), and pandas with Python's re otherwise
+        self.location["engines"] = {}
+
+        for key in ("patterns", "blacklist"):
+            if self.location[key] is None:
+                continue
+
+            if self.location["automata"][key] is not None:
+                engine = "automaton"
+            elif is_re2_compatible(self.location[key].pattern):
+                engine = "arrow"
+            else:
+                engine = "pandas"
+
+            self.location["engines"][key] = engine
+            self.logger.info(f"location {key}: matched with {engine}")
+
+        self.location["filter"] = self.location_filter()
+
+    def configure_terms(self):
+        self.automaton = ahocorasick.Automaton()
+
+        term_files = self.config["content"].get("term_files", None)
+        self.terms = {}
+
+        if term_files is not None:
+            term_files = list(
+                map(lambda x: self.config["path"].get("config") + "/" + x, term_files)
+            )
+            self.terms["patterns"] = []  # build_re_from_files(term_files)
+            for filename in term_files:
+                terms = read_list(filename)
+                self.terms["patterns"].extend(terms)
+                for term in terms:
+                    self.automaton.add_word(term.strip(), SEARCH_TERM)
+                self.logger.info(f"read keywords from {filename}: {terms}")
+        else:
+            self.logger.warning("no keyword terms used")
+            self.terms["patterns"] = None
+
+        blacklist = self.config["content"].get("blacklist_files", None)
+
+        if blacklist is None:
+            self.logger.warning("no blacklisted keywords used")
+            self.terms["blacklist"] = None
+        else:
+            blacklist = map(
+                lambda x: self.config["path"].get("config") + "/" + x, blacklist
+            )
+            self.terms["blacklist"] = []  # build_re_from_files(blacklist)
+
+            for filename in blacklist:
+                terms = read_list(filename)
+                self.terms["blacklist"].extend(terms)
+                for term in terms:
+                    self.automaton.add_word(term, REJECTED_TERM)
+                self.logger.info(f"read blacklisted keywords from {filename}: {terms}")
+
+        blacklist_urls = self.config.get("blacklist_urls", None)
+
+        if blacklist_urls is not None:
+            blacklist_urls = map(
+                lambda x: self.config["path"].get("config") + "/" + x, blacklist_urls
+            )
+            self.terms["blacklist_urls"] = build_re_from_files(blacklist_urls)
+        else:
+            self.logger.warning("no blacklisted URLs")
+
+        self.automaton.make_automaton()
+
+        search_terms = [t.strip() for t in self.terms["patterns"] or [] if t.strip()]
+        reject_terms = [t for t in self.terms["blacklist"] or [] if t]
+
+        self.terms["search_re"] = None
+        self.terms["reject_re"] = None
+        self.terms["database"] = None
+        self.terms["filter"] = None
+
+        if len(search_terms) + len(reject_terms) <= MAX_REGEX_TERMS:
+            self.terms["search_re"] = compile_terms(search_terms)
+            self.terms["reject_re"] = compile_terms(reject_terms)
+
+            if len(self.automaton):
+                self.terms["filter"] = self.terms_filter()
+        elif hyperscan is not None:
+            self.logger.info("too many terms, using hyperscan to filter tweets")
+            self.terms["database"] = compile_hyperscan_database(
+                search_terms, reject_terms
+            )
+        else:
+            self.logger.info("too many terms, using the automaton to filter tweets")
+
+    def configure_language(self):
+        self.languages = self.config["content"].get("accepted_lang", None)
+
+    def configure_tokenizer(self):
+        dtm_config = self.config["content"].get("user_matrix", {})
+        ngram_range = dtm_config.get("ngram_range", None)
+        stopwords_file = dtm_config.get("stopwords_file", None)
+
+        if "lru_size" in dtm_config:
+            self.logger.warning(
+                "user_matrix.lru_size is deprecated and ignored: tokens are cached "
+                "per partition without a size limit"
+            )
+
+        if stopwords_file is not None:
+            stopwords_file = self.config["path"].get("config") + "/" + stopwords_file
+            self.logger.info(f"stopwords file: {stopwords_file}")
+
+        if stopwords_file is None:
+            stopwords = frozenset()
+            self.logger.info("no stopwords")
+        else:
+            stopwords = frozenset(read_list(stopwords_file))
+            self.logger.info(f"#stopwords: {len(stopwords)}")
+
+        if ngram_range is not None:
+            ngram_range = tuple(ngram_range)
+
+        self.tokenizer_options = {
+            "ngram_range": ngram_range,
+            "stopwords": stopwords,
+        }
+        self.build_tokenizer()
+
+    def build_tokenizer(self):
+        """
+        Builds the tokenizer and an empty token cache. The cache is a plain dict,
+        reset for every partition, with no size limit: it holds the tokens of every
+        distinct text, user name and description of the day being imported.
+        """
+        options = self.tokenizer_options
+        self.tokenize = partial(
+            tokenize,
+            ngram_range=options["ngram_range"],
+            stopwords=options["stopwords"],
+        )
+        # tokens of every distinct string seen in the current partition. retweets and
+        # quotes repeat the same texts across files, so a bounded LRU misses most of them
+        self.token_cache = {}
+
+    def __getstate__(self):
+        # importers are sent to worker processes already configured. the tokenizer
+        # and its cache are rebuilt there and hyperscan databases need their own format
+        state = self.__dict__.copy()
+        del state["tokenize"]
+        del state["token_cache"]
+
+        if self.terms["database"] is not None:
+            state["terms"] = dict(
+                self.terms, database=hyperscan.dumpb(self.terms["database"])
+            )
+
+        return state
+
+    def __setstate__(self, state):
+        if state["terms"]["database"] is not None:
+            state["terms"] = dict(
+                state["terms"],
+                database=hyperscan.loadb(
+                    state["terms"]["database"], hyperscan.HS_MODE_BLOCK
+                ),
+            )
+
+        self.__dict__.update(state)
+        self.build_tokenizer()
+
+    def data_path(self):
+        return Path(self.config["path"].get("data"))
+
+    def parse_date_data_to_parquet(
+        self, date, pattern, source_path, target_path, periods=24 * 6, freq="10t"
+    ):
+        date = pd.to_datetime(date)
+
+        if type(source_path) == str:
+            source_path = Path(source_path)
+        elif not isinstance(source_path, Path):
+            raise ValueError(
+                f"source_path is not a valid object (Path or str needed, got {type(source_path)})"
+            )
+
+        if not source_path.exists():
+            raise ValueError(f"source_path ({source_path}) is not a valid path")
+
+        self.logger.info(f"Source folder: {source_path}")
+
+        if not source_path.exists():
+            raise IOError(f"{source_path} does not exist")
+
+        data_date = self.timezone.localize(date).astimezone(pytz.utc)
+        self.logger.info(f"UTC start date: {data_date}")
+
+        task_files = []
+
+        for date in pd.date_range(data_date, periods=periods, freq=freq):
+            file_path = source_path / pattern.format(date.strftime("%Y%m%d%H%M"))
+
+            if not file_path.exists():
+                self.logger.info(f"{file_path} does not exist")
+            else:
+                task_files.append(file_path)
+
+        self.logger.info(f"#files to transform: {len(task_files)}")
+
+        read_tweets = self.import_parquet_files(task_files, target_path)
+        return read_tweets
+
+    def import_parquet_files(self, file_names, target_path):
+        if not target_path.exists():
+            target_path.mkdir(parents=True)
+            self.logger.info("{} directory created".format(target_path))
+        else:
+            self.logger.info("{} exists".format(target_path))
+
+        tasks = [
+            dask.delayed(self._parse_files_to_parquet)(i, f, target_path)
+            for i, f in enumerate(file_names)
+        ]
+        # pyarrow releases the GIL while parsing, threads are enough here
+        read_tweets = sum(
+            dask.compute(*tasks, scheduler="threads", num_workers=self.n_jobs)
+        )
+        self.logger.info(f"done! imported {read_tweets} tweets from {len(file_names)}")
+        return read_tweets
+
+    def _parse_files_to_parquet(self, i, filename, target_path):
+        try:
+            df = json.read_json(filename)
+        except zlib.error:
+            self.logger.error(f"ZLIB EXCEPTION - (#{i}) corrupted file: {filename}")
+            return 0
+        except pa.lib.ArrowInvalid:
+            self.logger.error(f"PYARROW EXCEPTION - (#{i}) corrupted file: {filename}")
+            return 0
+
+        target_file = target_path / f"{Path(filename).stem}.parquet"
+
+        write_table(df, target_file)
+        return df.num_rows
+
+    def import_date(self, date, pattern, source_path, periods=24 * 6, freq="10t"):
+        date_str = date
+        date = pd.to_datetime(date)
+
+        if type(source_path) == str:
+            source_path = Path(source_path)
+        elif not isinstance(source_path, Path):
+            raise ValueError(
+                f"source_path is not a valid object (Path or str needed, got {type(source_path)})"
+            )
+
+        if not source_path.exists():
+            raise ValueError(f"source_path ({source_path}) is not a valid path")
+
+        self.logger.info(f"Source folder: {source_path}")
+
+        if not source_path.exists():
+            raise IOError(f"{source_path} does not exist")
+
+        data_date = self.timezone.localize(date).astimezone(pytz.utc)
+        self.logger.info(f"UTC start date: {data_date}")
+
+        task_files = []
+
+        for date in pd.date_range(data_date, periods=periods, freq=freq):
+            file_path = source_path / pattern.format(date.strftime("%Y%m%d%H%M"))
+
+            if not file_path.exists():
+                self.logger.info(f"{file_path} does not exist")
+                pass
+            else:
+                task_files.append(file_path)
+
+        self.logger.info(f"#files to import: {len(task_files)}")
+
+        parquet_path = self.data_path() / "raw" / date_str
+
+        imported_tweets = self.import_files(
+            task_files, parquet_path, file_prefix="tweets.partition"
+        )
+        return imported_tweets
+
+    def import_files(self, file_names, target_path, file_prefix=None):
+        if not target_path.exists():
+            target_path.mkdir(parents=True)
+            self.logger.info("{} directory created".format(target_path))
+        else:
+            self.logger.info("{} exists".format(target_path))
+
+        tasks = [(i, f, target_path, file_prefix) for i, f in enumerate(file_names)]
+        # the token cache is scoped to a partition to bound its memory
+        self.token_cache = {}
+
+        if self.n_jobs > 1:
+            # filtering and tokenizing are CPU-bound, so we use processes to avoid the GIL
+            with ProcessPoolExecutor(
+                max_workers=self.n_jobs,
+                initializer=_init_worker,
+                initargs=(self,),
+            ) as pool:
+                read_tweets = sum(pool.map(_read_parquet_file_worker, tasks))
+        else:
+            # read the next files from disk while the current one is processed
+            read_tweets = sum(
+                self._read_parquet_file(i, filename, target_path, file_prefix, data)
+                for i, (filename, data) in enumerate(prefetch_files(file_names))
+            )
+
+        self.token_cache = {}
+        self.logger.info(f"done! imported {read_tweets} tweets")
+        return read_tweets
+
+    def _read_parquet_file(self, i, filename, target_path, file_prefix=None, data=None):
+        if data is not None:
+            df = self.read_tweet_dataframe(pa.BufferReader(data))
+        else:
+            df = self.read_tweet_dataframe(filename)
+
+        if file_prefix is not None:
+            target_file = target_path / f"{file_prefix}.{i}.parquet"
+        else:
+            target_file = target_path / f"{Path(filename).stem}.{i}.parquet"
+
+        # names and descriptions repeat across the tweets of a user, so we tokenize
+        # every distinct string once and then map the results back to each column
+        token_columns = {
+            "tweet.tokens": "text",
+            "user.description_tokens": "user.description",
+            "user.name_tokens": "user.name",
+        }
+        unique_strings = pd.Index(
+            pd.unique(
+                pd.concat([df[column] for column in token_columns.values()]).dropna()
+            )
+        )
+        token_cache = self.token_cache
+        missing = [s for s in unique_strings if s not in token_cache]
+        token_cache.update(zip(missing, map(self.tokenize, missing)))
+
+        # token lists are built as Arrow lists once per distinct string, and then
+        # gathered for each row, so no Python list is created per row
+        unique_tokens = pa.array(
+            [token_cache[s] for s in unique_strings], type=pa.list_(pa.string())
+        )
+
+        # we transform dates from format Sat Jan 01 11:27:55 +0000 2022 to datetime object
+        df["created_at"] = pd.to_datetime(df["created_at"], format=twitter_date_format)
+        df["user.created_at"] = pd.to_datetime(
+            df["user.created_at"], format=twitter_date_format
+        )
+
+        table = pa.Table.from_pandas(df)
+
+        for target_column, source_column in token_columns.items():
+            positions = unique_strings.get_indexer(df[source_column])
+            table = table.append_column(
+                target_column,
+                unique_tokens.take(pa.array(positions, mask=positions < 0)),
+            )
+
+        # tokens repeat a lot, dictionary encoding stores each one once per row group
+        write_table(
+            table,
+            target_file,
+            use_dictionary=[f"{column}.list.element" for column in token_columns],
+        )
+        return len(df)
+
+
+# each worker process receives a copy of the configured importer once, so term
+# files are not read again and automata are not rebuilt for every worker
+_worker_importer = None
+
+
+def _init_worker(importer):
+    global _worker_importer
+    _worker_importer = importer
+
+
+def _read_parquet_file_worker(task):
+    return _worker_importer._read_parquet_file(*task)
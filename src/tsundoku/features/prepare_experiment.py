@@ -1,25 +1,33 @@
 import toml
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 import dask.dataframe as dd
 import dask
 import click
-import copy
 import logging
 import os
 import matplotlib
 
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from scipy.sparse import dok_matrix, save_npz, csr_matrix
+from scipy.sparse import save_npz
 from dotenv import find_dotenv, load_dotenv
-from aves.models.network import Network
+from graph_tool import Graph, GraphView
+from graph_tool.topology import label_components
 
-from tsundoku.utils.files import read_toml, write_parquet
+from tsundoku.utils.files import file_size, read_toml, write_parquet
 from tsundoku.utils.urls import get_domain
-from tsundoku.utils.dtm import build_vocabulary, tokens_to_document_term_matrix
+from tsundoku.utils.dtm import (
+    build_csr_matrix,
+    build_vocabulary,
+    occurrences_to_matrix,
+    token_occurrences,
+)
 from tsundoku.utils.vocabulary import filter_vocabulary
 from tsundoku.utils.timer import Timer
 
@@ -42,7 +50,8 @@ def main(experiment, overwrite):
         "project"
     ]
     logger.info(str(config))
-    dask.config.set(pool=ThreadPool(int(config.get("n_jobs", 2))))
+    n_jobs = int(config.get("n_jobs", 2))
+    dask.config.set(pool=ThreadPool(n_jobs))
 
     source_path = Path(config["path"]["data"]) / "raw"
     experiment_file = Path(config["path"]["config"]) / "experiments.toml"
@@ -112,12 +121,16 @@ def main(experiment, overwrite):
     chronometer = []
     process_names = []
 
+    # interactions and tweet counts are independent aggregations, so their task
+    # graphs are computed together and share the thread pool
+    t.start()
+    pending = []
+
     for int_name, int_column in (
         ("reply", "in_reply_to_user_id"),
         ("quote", "quote.user.id"),
         ("retweet", "rt.user.id"),
     ):
-        t.start()
         try:
             interaction_dd = dd_from_parquet_paths(
                 [d / f"{int_name}_edgelist.parquet" for d in data_paths]
@@ -126,22 +139,36 @@ def main(experiment, overwrite):
             df = pd.DataFrame(columns=["user.id", int_column, "frequency"])
             interaction_dd = dd.from_pandas(df, npartitions=0)
 
-        group_user_interactions(
-            interaction_dd,
-            key_column,
-            int_column,
-            int_name,
+        pending.append(
+            group_user_interactions(
+                interaction_dd,
+                key_column,
+                int_column,
+                int_name,
+                processed_path,
+                overwrite=overwrite,
+                split_out=n_jobs,
+                compute=False,
+            )
+        )
+
+    pending.append(
+        count_user_tweets(
+            data_paths,
             processed_path,
             overwrite=overwrite,
+            split_out=n_jobs,
+            compute=False,
         )
+    )
+    dask.compute(*pending)
 
-        current_timer = t.stop()
-        chronometer.append(current_timer)
-        process_names.append(f"{int_name}_interaction")
+    current_timer = t.stop()
+    chronometer.append(current_timer)
+    process_names.append("interactions_and_tweet_counts")
 
     # users
     t.start()
-    count_user_tweets(data_paths, processed_path, overwrite=overwrite)
     group_users(
         data_paths,
         processed_path,
@@ -162,14 +189,17 @@ def main(experiment, overwrite):
         stopwords_file = None
 
     min_freq = experiment_config["thresholds"].get("name_tokens", 50)
-    # we read this again to catch changes in biographies and so on
-    users_dd = dd_from_parquet_paths([d / "unique_users.parquet" for d in data_paths])
+    # we read this again to catch changes in biographies and so on. three builders
+    # use it, so it is loaded once and kept in memory
+    users_dd = dd_from_parquet_paths(
+        [d / "unique_users.parquet" for d in data_paths]
+    ).persist()
     # this file exists from group_users
+    # a Series instead of a dict, so mapping id columns is a vectorized lookup
     elem_to_id = (
-        dd.read_parquet(processed_path / "user.elem_ids.parquet")
+        pd.read_parquet(processed_path / "user.elem_ids.parquet")
         .set_index("user.id")["row_id"]
-        .compute()
-        .to_dict()
+        .astype(np.int64)
     )
 
     t.start()
@@ -219,6 +249,7 @@ def main(experiment, overwrite):
         min_freq=min_freq,
         stopwords_file=stopwords_file,
         overwrite=overwrite,
+        split_out=n_jobs,
     )
     current_timer = t.stop()
     chronometer.append(current_timer)
@@ -243,7 +274,12 @@ def main(experiment, overwrite):
     urls_dd = dd_from_parquet_paths([d / "user_urls.parquet" for d in data_paths])
     min_freq = experiment_config["thresholds"].get("tweet_domains", 50)
     group_user_urls(
-        urls_dd, elem_to_id, processed_path, min_freq=min_freq, overwrite=overwrite
+        urls_dd,
+        elem_to_id,
+        processed_path,
+        min_freq=min_freq,
+        overwrite=overwrite,
+        split_out=n_jobs,
     )
     current_timer = t.stop()
     chronometer.append(current_timer)
@@ -269,32 +305,58 @@ def main(experiment, overwrite):
     logger.info("Chronometer process names: " + str(process_names))
 
 
-def dd_from_parquet_paths(paths, min_size=100):
-    valid_paths = list(
-        filter(lambda x: os.path.exists(x) and os.stat(x).st_size >= min_size, paths)
+def valid_parquet_paths(paths, min_size=100, n_threads=8):
+    paths = list(paths)
+
+    # stat calls are slow on network filesystems, so they are issued concurrently
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        sizes = list(pool.map(file_size, paths))
+
+    return [path for path, size in zip(paths, sizes) if size >= min_size]
+
+
+def dd_from_parquet_paths(paths, min_size=100, blocksize="64MiB"):
+    # large files are split by row groups, so no partition is bigger than blocksize
+    return dd.read_parquet(
+        valid_parquet_paths(paths, min_size=min_size),
+        split_row_groups="adaptive",
+        blocksize=blocksize,
     )
-    return dd.read_parquet(valid_paths)
 
 
-def count_user_tweets(data_paths, destination_path, overwrite=False):
+def pd_from_parquet_paths(paths, min_size=100):
+    # for frames that are materialized anyway: Arrow reads and converts them with
+    # its own threads, without building a task graph
+    return pa.concat_tables(
+        [pq.read_table(path) for path in valid_parquet_paths(paths, min_size=min_size)],
+        promote_options="default",
+    ).to_pandas()
+
+
+def count_user_tweets(
+    data_paths, destination_path, overwrite=False, split_out=1, compute=True
+):
     count_target = destination_path / "user.total_tweets.parquet"
 
     if not overwrite and count_target.exists():
         logging.info("total tweet counts were computed! skipping.")
         return
 
-    tweet_dd = (
+    def write_counts(tweet_counts):
+        tweet_counts = (
+            tweet_counts.rename("user.dataset_tweets").sort_values().reset_index()
+        )
+        write_parquet(tweet_counts, count_target)
+        logging.info(f"user tweet counts -> {count_target}")
+
+    task = dask.delayed(write_counts)(
         dd_from_parquet_paths([d / "tweets_per_user.parquet" for d in data_paths])
         .groupby("user.id")["0"]
-        .sum()
-        .compute()
-        .rename("user.dataset_tweets")
-        .sort_values()
-        .reset_index()
+        .sum(split_out=split_out)
     )
 
-    write_parquet(tweet_dd, count_target)
-    logging.info(f"user tweet counts -> {count_target}")
+    # with compute=False the task is returned to be computed along with others
+    return task.compute() if compute else task
 
 
 def group_users(
@@ -313,11 +375,9 @@ def group_users(
         logging.info("users were already grouped! skipping.")
         return
 
-    users = (
-        dd_from_parquet_paths([d / "unique_users.parquet" for d in data_paths])
-        .compute()
-        .drop_duplicates(subset="user.id", keep="last")
-    )
+    users = pd_from_parquet_paths(
+        [d / "unique_users.parquet" for d in data_paths]
+    ).drop_duplicates(subset="user.id", keep="last")
 
     if discussion_only:
         logging.info(f"total #users before filtering by discussion: {len(users)}")
@@ -331,11 +391,9 @@ def group_users(
 
     logging.info(f"total #users: {len(users)}")
 
-    tweet_count = (
-        dd.read_parquet(processed_path / "user.total_tweets.parquet")
-        .set_index("user.id")
-        .compute()
-    )
+    tweet_count = pd.read_parquet(
+        processed_path / "user.total_tweets.parquet"
+    ).set_index("user.id")
 
     users = users.join(tweet_count, on="user.id", how="inner").sort_values(
         "user.dataset_tweets", ascending=False
@@ -401,20 +459,22 @@ def build_vocabulary_and_matrix(
         logging.info(f"{elem_type}.{token_column} matrix exists! skipping.")
     else:
         if relevant_vocabulary is None:
-            relevant_vocabulary = dd.read_parquet(relevant_vocabulary_target).set_index(
+            relevant_vocabulary = pd.read_parquet(relevant_vocabulary_target).set_index(
                 "token"
             )
         token_to_id = relevant_vocabulary["token_id"].to_dict()
-        token_matrices = dask_df.map_partitions(
-            lambda df: tokens_to_document_term_matrix(
-                df, key_column, token_column, token_to_id, id_to_row=elem_to_id
-            ),
-            meta=(
-                "matrix",
-                np.dtype("O"),
-            ),
+        # partitions yield token occurrences, and a single matrix is built from them
+        occurrences = dask_df.map_partitions(
+            token_occurrences,
+            key_column,
+            token_column,
+            token_to_id,
+            elem_to_id,
+            meta={"row_id": int, "column_id": int},
+        ).compute()
+        token_matrix = occurrences_to_matrix(
+            occurrences, (elem_to_id.max() + 1, max(token_to_id.values()) + 1)
         )
-        token_matrix = token_matrices.compute().sum()
         save_npz(token_matrix_target, token_matrix)
         logging.info(f"{elem_type}.{token_column} matrix -> {token_matrix_target}")
 
@@ -426,6 +486,7 @@ def build_user_tweets_term_matrix(
     min_freq=50,
     stopwords_file=None,
     overwrite=False,
+    split_out=1,
 ):
     full_vocabulary_target = destination_path / "user.tweet_vocabulary.all.parquet"
     relevant_full_vocabulary_target = (
@@ -462,20 +523,27 @@ def build_user_tweets_term_matrix(
         logging.info(f"user.tweet_tokens matrix exists! skipping.")
     else:
         if relevant_full_vocabulary is None:
-            relevant_full_vocabulary = dd.read_parquet(
+            relevant_full_vocabulary = pd.read_parquet(
                 relevant_full_vocabulary_target
             ).set_index("token")
 
         # print(elem_to_id)
+        # rows are filtered within each partition before the groupby shuffles them,
+        # testing membership against arrays that are built only once
+        user_ids = elem_to_id.index.to_numpy()
+        tokens = relevant_full_vocabulary.index.to_numpy()
+
         user_tweet_frequency = (
-            term_frequencies.pipe(
-                lambda x: x[
-                    (x["user.id"].isin(elem_to_id.keys()))
-                    & (x["token"].isin(relevant_full_vocabulary.index))
-                ]
+            term_frequencies.map_partitions(
+                lambda x, user_ids, tokens: x[
+                    x["user.id"].isin(user_ids) & x["token"].isin(tokens)
+                ],
+                user_ids,
+                tokens,
+                meta=term_frequencies._meta,
             )
-            .groupby(["user.id", "token"])
-            .sum()
+            .groupby(["user.id", "token"])["frequency"]
+            .sum(split_out=split_out)
             .compute()
         )
 
@@ -484,19 +552,15 @@ def build_user_tweets_term_matrix(
         tweet_token_to_id = relevant_full_vocabulary["token_id"].to_dict()
         # print(tweet_token_to_id)
 
-        dtm = dok_matrix(
-            (max(elem_to_id.values()) + 1, max(tweet_token_to_id.values()) + 1),
-            dtype=int,
-        )
+        # the matrix is assembled in bulk from (row, column, value) arrays
+        user_tweet_frequency = user_tweet_frequency.reset_index()
 
-        for row in user_tweet_frequency.itertuples():
-            if not row.Index[0] in elem_to_id:
-                continue
-            row_id = elem_to_id[row.Index[0]]
-            column_id = tweet_token_to_id[row.Index[1]]
-            dtm[row_id, column_id] = getattr(row, "frequency")
-
-        dtm = dtm.tocsr()
+        dtm = build_csr_matrix(
+            user_tweet_frequency["user.id"].map(elem_to_id).to_numpy(),
+            user_tweet_frequency["token"].map(tweet_token_to_id).to_numpy(),
+            (elem_to_id.max() + 1, max(tweet_token_to_id.values()) + 1),
+            values=user_tweet_frequency["frequency"].to_numpy(),
+        )
         logging.info(f"user.tweet_tokens matrix: {repr(dtm)}")
 
         save_npz(tweet_matrix_target, dtm)
@@ -510,46 +574,65 @@ def find_nodes_in_discussion(
     min_total_degree=1,
     overwrite=False,
 ):
-    layers = pd.DataFrame(columns=["source.id", "target.id"])
+    layer_names = ["retweet", "quote", "reply"]
+    layers = []
 
-    for layer_name, layer_column in (
-        ("retweet", "rt.user.id"),
-        ("quote", "quote.user.id"),
-        ("reply", "in_reply_to_user_id"),
+    for layer_name, layer_column in zip(
+        layer_names, ("rt.user.id", "quote.user.id", "in_reply_to_user_id")
     ):
-        layer = dd.read_parquet(processed_path / f"user.{layer_name}_edges.all.parquet")
+        layer = pd.read_parquet(processed_path / f"user.{layer_name}_edges.all.parquet")
         if len(layer.columns) == 0:
             layer = pd.DataFrame(columns=["user.id", layer_column, "frequency"])
-        layer.columns = ["source.id", "target.id", layer_name]
-        layer_pd = layer.compute()
-        layers = layers.merge(layer_pd, how="outer").fillna(0)
-        logging.info(f"full network layer {layer_name}: {layers.shape}")
+        layer.columns = ["source.id", "target.id", "frequency"]
+        layer_pd = layer.assign(layer=layer_name)
+        layers.append(layer_pd)
+        logging.info(f"full network layer {layer_name}: {layer_pd.shape}")
+
+    # a single aggregation over the stacked layers instead of one outer merge per layer
+    layers = (
+        pd.concat(layers, ignore_index=True)
+        .groupby(["source.id", "target.id", "layer"])["frequency"]
+        .sum()
+        .unstack("layer", fill_value=0)
+        .reindex(columns=layer_names, fill_value=0)
+        .astype(int)
+        .assign(weight=lambda x: x.sum(axis=1))
+        .rename_axis(columns=None)
+        .reset_index()
+    )
+    logging.info(f"full network: {layers.shape}")
 
-    for layer_name in ["retweet", "reply", "quote"]:
-        layers[layer_name] = layers[layer_name].astype(int)
+    edges = layers[layers["weight"] >= min_edge_weight]
 
-    layers["weight"] = layers[["retweet", "reply", "quote"]].sum(axis=1)
+    # vertices are the factorized user ids, so the edge list goes to graph-tool as
+    # a single (source, target, weight) array
+    codes, node_ids = pd.factorize(
+        pd.concat([edges["source.id"], edges["target.id"]], ignore_index=True)
+    )
 
-    network = Network.from_edgelist(
-        layers[layers["weight"] >= min_edge_weight],
-        source="source.id",
-        target="target.id",
-        weight="weight",
-        directed=True,
-    ).largest_connected_component(directed=directed)
+    graph = Graph(directed=True)
+    graph.add_vertex(len(node_ids))
+    edge_weight = graph.new_edge_property("int64_t")
+    graph.add_edge_list(
+        np.column_stack(
+            [
+                codes[: len(edges)],
+                codes[len(edges) :],
+                edges["weight"].to_numpy(),
+            ]
+        ).astype(np.int64),
+        eprops=[edge_weight],
+    )
 
-    nodes_in_largest = list(network.graph.vertex_properties["elem_id"])
+    # the component sizes come with the labels, no need to count them again
+    components, component_sizes = label_components(graph, directed=directed)
+    in_largest = components.a == np.argmax(component_sizes)
+    largest_component = GraphView(graph, vfilt=in_largest)
 
-    logging.info(f"total #nodes in largest component: {len(nodes_in_largest)}")
+    logging.info(f"total #nodes in largest component: {in_largest.sum()}")
 
-    node_degree = network.estimate_node_degree("total")
-    filtered_nodes = [
-        node_id
-        for degree, node_id in zip(
-            node_degree, network.graph.vertex_properties["elem_id"]
-        )
-        if degree >= min_total_degree
-    ]
+    node_degree = largest_component.degree_property_map("total", weight=edge_weight)
+    filtered_nodes = node_ids[in_largest & (node_degree.a >= min_total_degree)].tolist()
 
     logging.info(
         f"total #nodes after filtering by total degree (min={min_total_degree}): {len(filtered_nodes)}"
@@ -574,41 +657,48 @@ def build_network(
         logging.info(f"{name} adjacency matrix exists! skipping.")
         return
 
-    edges = dd.read_parquet(edges_path, lines=True).pipe(
-        lambda x: x[x[source_column].isin(elem_to_id.keys())]
+    edges = pd.read_parquet(edges_path).pipe(
+        lambda x: x[x[source_column].isin(elem_to_id.index)]
     )
 
-    unique_user_ids = set(edges[source_column].unique()) | set(
-        edges[target_column].unique()
+    # sources and targets are factorized together, so each column is a slice of codes
+    codes, unique_user_ids = pd.factorize(
+        pd.concat([edges[source_column], edges[target_column]], ignore_index=True)
+    )
+    non_dataset_users = np.setdiff1d(
+        unique_user_ids.to_numpy(),
+        elem_to_id.index.to_numpy(),
     )
-    id_to_node = copy.deepcopy(elem_to_id)
-
-    non_dataset_users = list(filter(lambda x: not x in id_to_node, unique_user_ids))
 
-    id_to_node.update(
-        dict(
-            zip(
-                non_dataset_users,
-                range(len(id_to_node), len(id_to_node) + len(non_dataset_users)),
-            )
-        )
+    # users outside the dataset are numbered after the dataset users
+    id_to_node = pd.concat(
+        [
+            elem_to_id,
+            pd.Series(
+                np.arange(
+                    len(elem_to_id),
+                    len(elem_to_id) + len(non_dataset_users),
+                    dtype=np.int64,
+                ),
+                index=non_dataset_users,
+            ),
+        ]
     )
 
-    id_to_node_df = pd.Series(id_to_node).rename("node_id").reset_index()
+    id_to_node_df = id_to_node.rename("node_id").rename_axis("index").reset_index()
     write_parquet(id_to_node_df, id_to_node_path)
 
-    edges["source"] = edges[source_column].map(id_to_node)
-    edges["target"] = edges[target_column].map(id_to_node)
+    unique_user_nodes = id_to_node.reindex(unique_user_ids).to_numpy()
+    edges["source"] = unique_user_nodes[codes[: len(edges)]]
+    edges["target"] = unique_user_nodes[codes[len(edges) :]]
 
     # users that are not in the network: an empty row. we need it, but we don't need empty columns
-    sparse_adjacency_matrix = dok_matrix((len(elem_to_id), len(id_to_node)), dtype=int)
-
-    for row in edges.itertuples():
-        sparse_adjacency_matrix[
-            getattr(row, "source"), getattr(row, "target")
-        ] = getattr(row, "frequency")
-
-    sparse_adjacency_matrix = sparse_adjacency_matrix.tocsr()
+    sparse_adjacency_matrix = build_csr_matrix(
+        edges["source"].to_numpy(),
+        edges["target"].to_numpy(),
+        (len(elem_to_id), len(id_to_node)),
+        values=edges["frequency"].to_numpy(),
+    )
     save_npz(adjacency_matrix_path, sparse_adjacency_matrix)
     logging.info(
         f"{name} adjacency matrix ({repr(sparse_adjacency_matrix)}) -> {adjacency_matrix_path}"
@@ -622,6 +712,8 @@ def group_user_interactions(
     interaction_name,
     destination_path,
     overwrite=False,
+    split_out=1,
+    compute=True,
 ):
     interactions_target = (
         destination_path / f"user.{interaction_name}_edges.all.parquet"
@@ -629,18 +721,24 @@ def group_user_interactions(
 
     if not overwrite and interactions_target.exists():
         logging.info(f"user.{interaction_name} exists! skipping.")
-    else:
-        interactions = (
-            interaction_dd.groupby([source_column, target_column]).sum().compute()
-        )
+        return
+
+    def write_interactions(interactions):
         write_parquet(interactions.reset_index(), interactions_target)
         logging.info(
             f"user.{interaction_name} (#{len(interactions)}) -> {interactions_target}"
         )
 
+    task = dask.delayed(write_interactions)(
+        interaction_dd.groupby([source_column, target_column]).sum(split_out=split_out)
+    )
+
+    # with compute=False the task is returned to be computed along with others
+    return task.compute() if compute else task
+
 
 def group_user_urls(
-    urls_dd, elem_to_id, destination_path, min_freq=50, overwrite=False
+    urls_dd, elem_to_id, destination_path, min_freq=50, overwrite=False, split_out=1
 ):
     url_frequency_target = destination_path / "user.domains.all.parquet"
     url_frequency_relevant_target = destination_path / "user.domains.relevant.parquet"
@@ -652,7 +750,12 @@ def group_user_urls(
         logging.info(f"user.domains matrix exists! skipping.")
         return
 
-    urls = urls_dd.groupby(["user.id", "domain"]).sum().compute().reset_index()
+    urls = (
+        urls_dd.groupby(["user.id", "domain"])
+        .sum(split_out=split_out)
+        .compute()
+        .reset_index()
+    )
 
     url_frequency = (
         urls.groupby("domain")["frequency"].sum().sort_values(ascending=False)
@@ -669,24 +772,16 @@ def group_user_urls(
         f"user.domains relevant vocabulary ({len(url_frequency_relevant)}) -> {url_frequency_relevant_target}"
     )
 
-    urls_relevant = urls[urls["domain"].isin(url_frequency_relevant.index)].set_index(
-        ["user.id", "domain"]
-    )
+    urls_relevant = urls[urls["domain"].isin(url_frequency_relevant.index)]
 
     url_to_id = url_frequency_relevant["token_id"].to_dict()
 
-    dtm = dok_matrix(
-        (max(elem_to_id.values()) + 1, max(url_to_id.values()) + 1), dtype=int
+    dtm = build_csr_matrix(
+        urls_relevant["user.id"].map(elem_to_id).to_numpy(),
+        urls_relevant["domain"].map(url_to_id).to_numpy(),
+        (elem_to_id.max() + 1, max(url_to_id.values()) + 1),
+        values=urls_relevant["frequency"].to_numpy(),
     )
-
-    for row in urls_relevant.itertuples():
-        if not row.Index[0] in elem_to_id:
-            continue
-        row_id = elem_to_id[row.Index[0]]
-        column_id = url_to_id[row.Index[1]]
-        dtm[row_id, column_id] = getattr(row, "frequency")
-
-    dtm = dtm.tocsr()
     save_npz(url_matrix_target, dtm)
     logging.info(f"user.domains matrix ({repr(dtm)}) -> {url_matrix_target}")
 
@@ -719,12 +814,19 @@ def group_profile_domains(
         .pipe(lambda x: x[x["user.url"].str.len() > 0].copy())
     )
 
-    profile_urls["user.profile_domain"] = profile_urls["user.url"].map(get_domain)
-    profile_urls["user.main_domain"] = (
-        profile_urls["user.profile_domain"].str.split(".").str.slice(-2).str.join(".")
+    # many users share urls and domains, so each distinct value is parsed once and
+    # the results are mapped back to the users
+    urls = profile_urls["user.url"].unique()
+    url_domains = pd.Series([get_domain(url) for url in urls], index=urls)
+    profile_urls["user.profile_domain"] = profile_urls["user.url"].map(url_domains)
+
+    domains = profile_urls["user.profile_domain"].unique()
+    domain_parts = [domain.split(".") for domain in domains]
+    profile_urls["user.main_domain"] = profile_urls["user.profile_domain"].map(
+        pd.Series([".".join(parts[-2:]) for parts in domain_parts], index=domains)
     )
-    profile_urls["user.tld"] = (
-        profile_urls["user.main_domain"].str.split(".").str.slice(-1).str.join("")
+    profile_urls["user.tld"] = profile_urls["user.profile_domain"].map(
+        pd.Series([parts[-1] for parts in domain_parts], index=domains)
     )
 
     profile_domains = (
@@ -748,21 +850,20 @@ def group_profile_domains(
     domain_to_id = dict(zip(profile_domains.index, range(len(profile_domains))))
 
     # logging.info(
-    #     f"user_main_domain_matrix CALL: {str(elem_to_id.values())} - {str(domain_to_id.values())}"
+    #     f"user_main_domain_matrix CALL: {str(elem_to_id.values)} - {str(domain_to_id.values())}"
     # )
-    user_main_domain_matrix = dok_matrix(
-        (max(elem_to_id.values()) + 1, max(domain_to_id.values()) + 1), dtype=int
-    )
-
-    for row in profile_urls.set_index(["user.id", "user.main_domain"]).itertuples():
-        try:
-            row_id = elem_to_id[row.Index[0]]
-            column_id = domain_to_id[row.Index[1]]
-        except KeyError:
-            continue
-        user_main_domain_matrix[row_id, column_id] = 1
+    # binary incidence matrices: each (user, domain) pair is stored once
+    user_domains = profile_urls[
+        profile_urls["user.id"].isin(elem_to_id.index)
+        & profile_urls["user.main_domain"].isin(domain_to_id.keys())
+    ].drop_duplicates(subset=["user.id", "user.main_domain"])
 
-    user_main_domain_matrix = user_main_domain_matrix.tocsr()
+    user_main_domain_matrix = build_csr_matrix(
+        user_domains["user.id"].map(elem_to_id).to_numpy(),
+        user_domains["user.main_domain"].map(domain_to_id).to_numpy(),
+        (elem_to_id.max() + 1, max(domain_to_id.values()) + 1),
+        dtype=np.int8,
+    )
 
     save_npz(user_main_domain_matrix_target, user_main_domain_matrix)
     logging.info(
@@ -782,19 +883,17 @@ def group_profile_domains(
 
     tld_to_id = dict(zip(profile_tlds.index, range(len(profile_tlds))))
 
-    user_tld_matrix = dok_matrix(
-        (max(elem_to_id.values()) + 1, max(tld_to_id.values()) + 1), dtype=int
-    )
+    user_tlds = profile_urls[
+        profile_urls["user.id"].isin(elem_to_id.index)
+        & profile_urls["user.tld"].isin(tld_to_id.keys())
+    ].drop_duplicates(subset=["user.id", "user.tld"])
 
-    for row in profile_urls.set_index(["user.id", "user.tld"]).itertuples():
-        try:
-            row_id = elem_to_id[row.Index[0]]
-            column_id = tld_to_id[row.Index[1]]
-        except KeyError:
-            continue
-        user_tld_matrix[row_id, column_id] = 1
-
-    user_tld_matrix = user_tld_matrix.tocsr()
+    user_tld_matrix = build_csr_matrix(
+        user_tlds["user.id"].map(elem_to_id).to_numpy(),
+        user_tlds["user.tld"].map(tld_to_id).to_numpy(),
+        (elem_to_id.max() + 1, max(tld_to_id.values()) + 1),
+        dtype=np.int8,
+    )
 
     save_npz(user_tld_matrix_target, user_tld_matrix)
     logging.info(
@@ -1,37 +1,177 @@
+import os
+import warnings
+
+import dask.array as da
 import numpy as np
 import pandas as pd
-from cytoolz import frequencies
-from sklearn.calibration import CalibratedClassifierCV
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix, issparse, vstack
+from sklearn.isotonic import IsotonicRegression
 from sklearn.metrics import classification_report
 from sklearn.model_selection import StratifiedKFold, train_test_split
 from sklearn.preprocessing import LabelEncoder
-from sklearn.utils.class_weight import compute_sample_weight
+from xgboost import build_info
 from xgboost.sklearn import XGBClassifier
 
+try:
+    from xgboost.dask import DaskXGBClassifier
+except ImportError:
+    DaskXGBClassifier = None
+
+
+def cuda_device_count():
+    if not build_info().get("USE_CUDA", False):
+        return 0
+
+    try:
+        import cupy
+    except ImportError:
+        return 0
+
+    try:
+        return cupy.cuda.runtime.getDeviceCount()
+    except cupy.cuda.runtime.CUDARuntimeError:
+        return 0
+
+
+def _balanced_weights(y):
+    # same weights as compute_sample_weight("balanced", y), in one np.unique pass
+    _, inverse, counts = np.unique(y, return_inverse=True, return_counts=True)
+    return (len(y) / (len(counts) * counts))[inverse]
+
+
+def _calibrate_proba(proba, calibrators):
+    # the same combination as sklearn's CalibratedClassifierCV
+    if proba.shape[1] == 2:
+        positive = calibrators[1].predict(proba[:, 1])
+        return np.column_stack([1 - positive, positive])
+
+    calibrated = np.column_stack(
+        [calibrator.predict(proba[:, i]) for i, calibrator in enumerate(calibrators)]
+    )
+
+    # uniform where every calibrator predicts zero
+    total = calibrated.sum(axis=1, keepdims=True)
+    return np.divide(
+        calibrated,
+        total,
+        out=np.full_like(calibrated, 1 / calibrated.shape[1]),
+        where=total > 0,
+    )
+
+
+def _argmax_threshold(proba, threshold):
+    # the winning class of each row, or -1 when its probability is too low
+    max_idx = proba.argmax(axis=1)
+    max_probability = np.take_along_axis(proba, max_idx[:, np.newaxis], axis=1)[:, 0]
+    max_idx[max_probability < threshold] = -1
+    return max_probability, max_idx
+
+
+def _labeled_mask(y):
+    mask = pd.notnull(y)
+    return mask.to_numpy() if hasattr(mask, "to_numpy") else mask
+
 
 class PartiallyLabeledXGB(object):
-    def __init__(self, xgb_params=None, seed=42, early_stopping_rounds=10):
-        self.xgb = XGBClassifier(**xgb_params)
+    def __init__(
+        self,
+        xgb_params=None,
+        seed=42,
+        early_stopping_rounds=10,
+        verbose=True,
+        backend="local",
+        chunk_rows=100_000,
+    ):
+        xgb_params = {"tree_method": "hist", "max_bin": 256, **(xgb_params or {})}
+
+        # train on the GPU when there is one, unless the caller chose a device
+        if (
+            xgb_params["tree_method"] == "hist"
+            and "device" not in xgb_params
+            and cuda_device_count() > 0
+        ):
+            xgb_params["device"] = "cuda"
+
+        if backend == "dask":
+            # distributed training on the workers of the current
+            # dask.distributed client. it is not out-of-core: the matrix is
+            # still loaded whole in this process and sent to the workers
+            if DaskXGBClassifier is None:
+                raise ImportError("the dask backend requires dask.distributed")
+            self.xgb = DaskXGBClassifier(**xgb_params)
+        elif backend == "local":
+            self.xgb = XGBClassifier(**xgb_params)
+        else:
+            raise ValueError(f"unknown backend: {backend}")
+
+        self.backend = backend
+        self.chunk_rows = chunk_rows
         self.xgb.set_params(early_stopping_rounds=early_stopping_rounds)
-        self.calibrated_clf = None
+        self.calibrators = None
         self.label_encoder = LabelEncoder()
+        self.verbose = verbose
 
-    def fit(self, X, y, eval_set=None, eval_fraction=0.1):
+    def _log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def _to_dask(self, data):
+        # sparse blocks of chunk_rows rows, so each worker trains on its own
+        # partitions. the client keeps the whole matrix in memory
+        chunks = (self.chunk_rows,) + tuple(data.shape[1:])
+        return da.from_array(data, chunks=chunks, asarray=False)
+
+    def _fit_xgb(self, F, y, **fit_params):
+        if self.backend == "dask":
+            F = self._to_dask(F)
+            y = self._to_dask(y)
+            fit_params["sample_weight"] = self._to_dask(fit_params["sample_weight"])
+
+            if "eval_set" in fit_params:
+                fit_params["eval_set"] = [
+                    (self._to_dask(F_eval), self._to_dask(y_eval))
+                    for F_eval, y_eval in fit_params["eval_set"]
+                ]
+
+        self.xgb.fit(F, y, **fit_params)
+
+    def fit(self, X, y, eval_set=None, eval_fraction=0.1, xgb_model=None):
         F = X
 
-        labeled_idx = np.arange(len(y))[pd.notnull(y)]
-        print("# rows with label", len(labeled_idx))
+        mask = _labeled_mask(y)
+        self._log("# rows with label", mask.sum())
 
-        F_labeled = F[labeled_idx]
-        y_labeled = self.label_encoder.fit_transform(y[labeled_idx])
+        F_labeled = F[mask]
+        y_labeled = self.label_encoder.fit_transform(np.asarray(y)[mask])
         self.classes_ = self.label_encoder.classes_
 
+        self._fit_labeled(
+            F_labeled,
+            y_labeled,
+            eval_set=eval_set,
+            eval_fraction=eval_fraction,
+            xgb_model=xgb_model,
+        )
+
+    def _fit_labeled(
+        self, F_labeled, y_labeled, eval_set=None, eval_fraction=0.1, xgb_model=None
+    ):
+        # y_labeled is already encoded with self.label_encoder
+        if F_labeled.dtype != np.float32:
+            # xgboost builds its histograms in single precision anyway
+            F_labeled = F_labeled.astype(np.float32, copy=False)
+
         fit_params = {}
 
+        if xgb_model is not None:
+            # continue boosting from an existing model instead of from scratch
+            fit_params["xgb_model"] = xgb_model
+
         if eval_set is not None:
             fit_params["eval_set"] = eval_set
-            fit_params["sample_weight"] = compute_sample_weight("balanced", y_labeled)
-            self.xgb.fit(F_labeled, y_labeled, **fit_params)
+            fit_params["sample_weight"] = _balanced_weights(y_labeled)
+            self._fit_xgb(F_labeled, y_labeled, **fit_params)
         elif eval_fraction > 0:
             (unique, counts) = np.unique(y_labeled, return_counts=True)
             if 1 not in counts:
@@ -43,13 +183,13 @@ class PartiallyLabeledXGB(object):
                     F_labeled, y_labeled, test_size=eval_fraction
                 )
 
-            print("# validation rows", len(y_val))
+            self._log("# validation rows", len(y_val))
             fit_params["eval_set"] = [[F_val, y_val]]
-            fit_params["sample_weight"] = compute_sample_weight("balanced", y_train)
-            self.xgb.fit(F_train, y_train, **fit_params)
+            fit_params["sample_weight"] = _balanced_weights(y_train)
+            self._fit_xgb(F_train, y_train, **fit_params)
         else:
-            fit_params["sample_weight"] = compute_sample_weight("balanced", y_labeled)
-            self.xgb.fit(F_labeled, y_labeled, **fit_params)
+            fit_params["sample_weight"] = _balanced_weights(y_labeled)
+            self._fit_xgb(F_labeled, y_labeled, **fit_params)
 
     def fit_calibrate(
         self,
@@ -59,59 +199,181 @@ class PartiallyLabeledXGB(object):
         eval_set=None,
         eval_fraction=0.1,
     ):
-        labeled_idx = np.arange(len(y))[pd.notnull(y)]
-        y_labeled = self.label_encoder.fit_transform(y[labeled_idx])
+        self.calibrators = None
+
+        mask = _labeled_mask(y)
+        y_labeled = self.label_encoder.fit_transform(np.asarray(y)[mask])
         self.classes_ = self.label_encoder.classes_
 
-        X_labeled = X[labeled_idx]
+        X_labeled = X[mask]
 
         X_train, X_val, y_train, y_val = train_test_split(
             X_labeled, y_labeled, test_size=val_fraction
         )
-        print("# calibration rows", len(y_val))
-        print(frequencies(y_val))
-        self.fit(X_train, y_train, eval_set=eval_set, eval_fraction=eval_fraction)
+        self._log("# calibration rows", len(y_val))
+
+        if self.verbose:
+            values, counts = np.unique(y_val, return_counts=True)
+            print(dict(zip(values.tolist(), counts.tolist())))
 
-        self.calibrated_clf = CalibratedClassifierCV(
-            self.xgb, cv="prefit", method="isotonic"
+        self._fit_labeled(
+            X_train, y_train, eval_set=eval_set, eval_fraction=eval_fraction
         )
-        self.calibrated_clf.fit(X_val, y_val)
+
+        # one isotonic regression per class, fitted on the held-out probabilities
+        proba = self.predict_proba(X_val)
+        self.calibrators = [
+            IsotonicRegression(out_of_bounds="clip").fit(proba[:, i], y_val == i)
+            for i in range(proba.shape[1])
+        ]
 
     def predict(self, X):
         F = X
 
-        if self.calibrated_clf is not None:
-            return self.label_encoder.inverse_transform(self.calibrated_clf.predict(F))
+        if (
+            self.calibrators is not None
+            or self.backend == "dask"
+            or (issparse(F) and F.format == "csr")
+        ):
+            return self.label_encoder.inverse_transform(
+                self.predict_proba(F).argmax(axis=1)
+            )
 
         return self.label_encoder.inverse_transform(self.xgb.predict(F))
 
     def predict_proba(self, X):
         F = X
-        if self.calibrated_clf is not None:
-            return self.calibrated_clf.predict_proba(F)
-        return self.xgb.predict_proba(F)
+        if issparse(F) and F.format == "csr":
+            proba = self._inplace_predict_proba(F)
+        elif self.backend == "dask":
+            proba = self.xgb.predict_proba(self._to_dask(F)).compute()
+        else:
+            proba = self.xgb.predict_proba(F)
+
+        if self.calibrators is not None:
+            proba = _calibrate_proba(proba, self.calibrators)
+
+        return proba
+
+    def _inplace_predict_proba(self, F):
+        # the booster reads the CSR arrays directly, without building a DMatrix
+        best_iteration = getattr(self.xgb, "best_iteration", None)
+        iteration_range = (0, 0) if best_iteration is None else (0, best_iteration + 1)
+
+        proba = self.xgb.get_booster().inplace_predict(
+            F, predict_type="value", iteration_range=iteration_range
+        )
+
+        if proba.ndim == 1:
+            proba = np.column_stack([1 - proba, proba])
+
+        return proba
 
     def classify_and_report(self, y_test, X_test, output_dict=False):
-        labeled_idx = np.arange(len(y_test))[pd.notnull(y_test)]
-        print("# rows with label", len(labeled_idx))
-        y_labeled = y_test[labeled_idx]
-        X_labeled = X_test[labeled_idx]
+        mask = _labeled_mask(y_test)
+        self._log("# rows with label", mask.sum())
+        y_labeled = np.asarray(y_test)[mask]
+        X_labeled = X_test[mask]
         y_predicted = self.predict(X_labeled)
         return classification_report(
             y_labeled, y_predicted, output_dict=output_dict, zero_division=1
         )
 
     def classify_and_label(self, X, min_probability, non_labeled_value=None):
-        results = pd.DataFrame(
-            self.predict_proba(X), columns=self.label_encoder.classes_
+        max_probability, max_idx = _argmax_threshold(
+            self.predict_proba(X), min_probability
+        )
+
+        label = np.where(
+            max_idx < 0, non_labeled_value, self.label_encoder.classes_[max_idx]
         )
-        results["max_probability"] = results.max(axis=1)
-        results["label"] = results[self.label_encoder.classes_].idxmax(axis=1)
-        results["source"] = "xgb"
 
-        results["label"][results.max_probability < min_probability] = non_labeled_value
+        return pd.DataFrame(
+            {"max_probability": max_probability, "label": label, "source": "xgb"}
+        )
+
+
+def _format_report(report, digits=2):
+    # the text table of classification_report, rebuilt from its dict output
+    headers = ["precision", "recall", "f1-score", "support"]
+    averages = [key for key in report if key == "accuracy" or key.endswith(" avg")]
+
+    width = max(len(key) for key in report)
+    width = max(width, len("weighted avg"), digits)
+    head_fmt = "{:>{width}s} " + " {:>9}" * len(headers)
+    row_fmt = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+    accuracy_fmt = (
+        "{:>{width}s} " + " {:>9.{digits}}" * 2 + " {:>9.{digits}f}" + " {:>9}\n"
+    )
+
+    def format_row(key, scores):
+        return row_fmt.format(
+            key,
+            scores["precision"],
+            scores["recall"],
+            scores["f1-score"],
+            int(scores["support"]),
+            width=width,
+            digits=digits,
+        )
+
+    lines = head_fmt.format("", *headers, width=width) + "\n\n"
+
+    for key, scores in report.items():
+        if key not in averages:
+            lines += format_row(key, scores)
+
+    lines += "\n"
+
+    for key in averages:
+        if key == "accuracy":
+            lines += accuracy_fmt.format(
+                key,
+                "",
+                "",
+                report[key],
+                int(report["weighted avg"]["support"]),
+                width=width,
+                digits=digits,
+            )
+        else:
+            lines += format_row(key, report[key])
+
+    return lines
+
+
+def _fit_one_fold(
+    start,
+    end,
+    X,
+    y,
+    xgb_parameters,
+    eval_fraction,
+    early_stopping_rounds,
+    xgb_model=None,
+    return_booster=False,
+    backend="local",
+):
+    # the test rows are X[start:end] and the train rows are the blocks around it
+    clf = PartiallyLabeledXGB(
+        xgb_params=xgb_parameters,
+        early_stopping_rounds=early_stopping_rounds,
+        backend=backend,
+    )
+    clf.fit(
+        vstack([X[:start], X[end:]], format="csr"),
+        np.concatenate([y[:start], y[end:]]),
+        eval_fraction=eval_fraction,
+        xgb_model=xgb_model,
+    )
+
+    report = clf.classify_and_report(y[start:end], X[start:end], output_dict=True)
+    report_str = _format_report(report)
+
+    if return_booster:
+        return report, report_str, clf.xgb.get_booster()
 
-        return results
+    return report, report_str
 
 
 def cross_validate(
@@ -123,34 +385,127 @@ def cross_validate(
     n_splits=5,
     random_state=42,
     null_name="__null__",
+    early_stopping_rounds=10,
+    n_jobs=None,
+    warm_start=False,
+    backend="local",
 ):
+    """Evaluates PartiallyLabeledXGB with stratified k-fold cross-validation.
+
+    With backend="dask", every fold trains on the current dask.distributed
+    client, one fold after another.
+
+    With warm_start=True, only the first fold trains from scratch and the
+    others refine its booster with fewer rounds. That booster was trained on
+    the test rows of every other fold, so their scores are optimistic due to
+    test-set leakage: use it for quick iterations, not to report metrics.
+    """
+    if warm_start:
+        warnings.warn(
+            "cross_validate(warm_start=True) leaks the test rows of folds after "
+            "the first one into their models: their scores are optimistic",
+            stacklevel=2,
+        )
+
     if stratify_on is None:
-        stratify_on = np.copy(y)
-        stratify_on[pd.isnull(stratify_on)] = null_name
+        stratify_on = np.where(pd.isnull(y), null_name, np.asarray(y, dtype=object))
 
     if len(stratify_on) != len(y):
         raise ValueError("stratify and y have different lengths")
 
     skf = StratifiedKFold(n_splits=n_splits)
+    test_folds = [
+        idx_test for _, idx_test in skf.split(np.arange(X.shape[0]), y=stratify_on)
+    ]
 
-    outputs = []
+    # the rows are permuted once so that every test fold is a contiguous block.
+    # folds then take cheap row slices instead of gathering rows from X, and
+    # joblib dumps the single shared matrix once to a memmap
+    bounds = np.cumsum([0] + [len(idx_test) for idx_test in test_folds])
+    folds = list(zip(bounds[:-1], bounds[1:]))
 
-    for idx_train, idx_test in skf.split(np.arange(X.shape[0]), y=stratify_on):
-        y_train = y[idx_train]
-        y_test = y[idx_test]
+    order = np.concatenate(test_folds)
+    X = csr_matrix(X, dtype=np.float32)[order]
+    X.sum_duplicates()
+    y = np.asarray(y)[order]
 
-        X_train = X[idx_train]
-        X_test = X[idx_test]
+    if backend == "dask":
+        # the loky workers do not see the client, so folds run in this process
+        n_jobs = 1
+    elif n_jobs is None:
+        n_jobs = n_splits
 
-        clf = PartiallyLabeledXGB(xgb_params=xgb_parameters)
-        clf.fit(
-            X_train,
-            y_train,
-            eval_fraction=eval_fraction,
+    # split the cores among the folds that train at the same time
+    fold_parameters = []
+    n_devices = cuda_device_count()
+
+    for i in range(len(folds)):
+        parameters = dict(xgb_parameters or {})
+        parameters.setdefault("n_jobs", max(1, (os.cpu_count() or 1) // n_jobs))
+
+        # resolve the device PartiallyLabeledXGB would pick, so that folds
+        # that default to the GPU are also spread over every device
+        device = parameters.get(
+            "device",
+            (
+                "cuda"
+                if n_devices and parameters.get("tree_method", "hist") == "hist"
+                else None
+            ),
         )
 
-        report = clf.classify_and_report(y_test, X_test, output_dict=True)
-        print(clf.classify_and_report(y_test, X_test, output_dict=False))
+        if device == "cuda" and n_devices > 1:
+            parameters["device"] = f"cuda:{i % n_devices}"
+
+        fold_parameters.append(parameters)
+
+    results = []
+    xgb_model = None
+
+    if warm_start:
+        # the first fold trains from scratch and the others only refine its
+        # booster with fewer rounds. this is much cheaper, but that booster
+        # saw the test rows of every later fold, so their scores are inflated
+        start, end = folds[0]
+        report, report_str, xgb_model = _fit_one_fold(
+            start,
+            end,
+            X,
+            y,
+            fold_parameters[0],
+            eval_fraction,
+            early_stopping_rounds,
+            return_booster=True,
+            backend=backend,
+        )
+        results.append((report, report_str))
+
+        # never more rounds than a fold trained from scratch would use
+        for parameters in fold_parameters[1:]:
+            n_estimators = parameters.get("n_estimators", 100)
+            parameters["n_estimators"] = min(n_estimators, max(50, n_estimators // 4))
+
+    results += Parallel(n_jobs=n_jobs, backend="loky", max_nbytes="1M")(
+        delayed(_fit_one_fold)(
+            start,
+            end,
+            X,
+            y,
+            parameters,
+            eval_fraction,
+            early_stopping_rounds,
+            xgb_model=xgb_model,
+            backend=backend,
+        )
+        for (start, end), parameters in zip(
+            folds[len(results) :], fold_parameters[len(results) :]
+        )
+    )
+
+    outputs = []
+
+    for report, report_str in results:
+        print(report_str)
         outputs.append(report)
 
     return outputs
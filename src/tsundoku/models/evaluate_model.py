@@ -155,7 +155,7 @@ def main(experiment, group, n_splits):
                 meta["account_ids"]["known_users"].extend(group_ids)
         else:
             # use them as labels
-            labels[key].loc[group_ids] = 1
+            labels.loc[group_ids, key] = 1
 
     xgb_parameters = experiment_config[group]["xgb"]
     pipeline_config = experiment_config[group]["pipeline"]
@@ -173,6 +173,7 @@ def main(experiment, group, n_splits):
         group,
         training_eval_fraction=pipeline_config["eval_fraction"],
         n_splits=n_splits,
+        backend=pipeline_config.get("backend", "local"),
     )
     logging.info(f"{str(outputs)}")
 
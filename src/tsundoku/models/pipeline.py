@@ -84,8 +84,9 @@ def process_matrix(
     tf_idf=False,
     skip_numeric_tokens=False,
 ):
+    # only the token and its id are needed to search and name the features
     raw_matrix, raw_features = load_matrix_and_features(
-        path, matrix_key, names_key, name, index=index, token_id=token_id
+        path, matrix_key, names_key, name, index=index, token_id=token_id, columns=[]
     )
 
     if skip_numeric_tokens:
@@ -99,7 +100,7 @@ def process_matrix(
         matrix = TfidfTransformer(norm="l1").fit_transform(matrix)
 
     labels = update_labels(labels.copy(), user_to_row_df, labeled_user_ids)
-    return labels, matrix, features.compute(), labeled_user_ids
+    return labels, matrix, features, labeled_user_ids
 
 
 def process_embedding_matrix(
@@ -268,7 +269,7 @@ def prepare_features(
                 subset_ids = labels[labels[key] > 0].sample(max_group_labels).index
                 print(len(subset_ids))
                 labels[key] = 0
-                labels[key].loc[subset_ids] = 1
+                labels.loc[subset_ids, key] = 1
 
 
 
@@ -408,6 +409,7 @@ def evaluate(
     stratify_on=None,
     n_splits=5,
     training_eval_fraction=0.1,
+    backend="local",
 ):
     outputs = cross_validate(
         parameters,
@@ -416,6 +418,7 @@ def evaluate(
         stratify_on=None,
         n_splits=n_splits,
         eval_fraction=training_eval_fraction,
+        backend=backend,
     )
     write_json(
         outputs, path / f"{elem_type}.classification_model.cross_validation.json"
@@ -433,10 +436,12 @@ def train_and_run_classifier(
     early_stopping_rounds=10,
     threshold_offset_factor=0.1,
     preserve_labels=True,
+    backend="local",
 ):
     clf = PartiallyLabeledXGB(
         xgb_params=parameters,
         early_stopping_rounds=early_stopping_rounds,
+        backend=backend,
     )
     clf.fit(
         X,
@@ -495,7 +500,8 @@ def classifier_pipeline(
     eval_fraction=0.15,
     threshold_offset_factor=0.1,
     skip_numeric_tokens=False,
-    max_group_labels=-1
+    max_group_labels=-1,
+    backend="local",
 ):
     X, single_labels, feature_names_all = prepare_features(
         path,
@@ -515,6 +521,7 @@ def classifier_pipeline(
         early_stopping_rounds=early_stopping_rounds,
         eval_fraction=eval_fraction,
         threshold_offset_factor=threshold_offset_factor,
+        backend=backend,
     )
     feature_names_all["xgb.relevance"] = clf.xgb.feature_importances_
     feature_names_all["label"] = (
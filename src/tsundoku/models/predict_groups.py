@@ -189,7 +189,7 @@ def main(experiment, group, max_group_labels):
                 meta["account_ids"]["known_users"].extend(group_ids)
         else:
             # use them as labels
-            labels[key].loc[group_ids] = 1
+            labels.loc[group_ids, key] = 1
 
     # special case: age
     if group == "age":
@@ -265,7 +265,8 @@ def main(experiment, group, max_group_labels):
         eval_fraction=pipeline_config["eval_fraction"],
         threshold_offset_factor=pipeline_config["threshold_offset_factor"],
         skip_numeric_tokens=skip_numeric_tokens,
-        max_group_labels=max_group_labels
+        max_group_labels=max_group_labels,
+        backend=pipeline_config.get("backend", "local"),
     )
 
     current_timer = t.stop()
@@ -1,5 +1,5 @@
-from collections import Counter, defaultdict
-from scipy.sparse import dok_matrix
+from scipy.sparse import coo_matrix
+import numpy as np
 import pandas as pd
 import dask.dataframe as dd
 
@@ -24,6 +24,58 @@ def build_vocabulary(vocab_df, token_column, to_lower=True, chunksize=10000):
     )
 
 
+def token_occurrences(df, id_column, token_column, token_to_column, id_to_row):
+    """
+    Returns a DataFrame with the (row_id, column_id) pair of every token occurrence
+    in df. Elements and tokens without an id are skipped.
+    """
+    tokens = df[[id_column, token_column]].explode(token_column)
+
+    return (
+        pd.DataFrame(
+            {
+                "row_id": tokens[id_column].map(id_to_row),
+                "column_id": tokens[token_column].map(token_to_column),
+            }
+        )
+        .dropna()
+        .astype(np.int32)
+        .reset_index(drop=True)
+    )
+
+
+def build_csr_matrix(row_ids, column_ids, shape, values=None, dtype=np.int32):
+    """
+    Builds a CSR matrix from aligned arrays of row ids, column ids and values (ones
+    if not given). Entries with a missing row or column id are skipped, and
+    duplicated entries are summed.
+    """
+    row_ids = np.asarray(row_ids)
+    column_ids = np.asarray(column_ids)
+    valid = ~(pd.isna(row_ids) | pd.isna(column_ids))
+
+    if values is None:
+        values = np.ones(valid.sum(), dtype=dtype)
+    else:
+        values = np.asarray(values)[valid]
+
+    return coo_matrix(
+        (
+            values,
+            (row_ids[valid].astype(np.int32), column_ids[valid].astype(np.int32)),
+        ),
+        shape=shape,
+        dtype=dtype,
+    ).tocsr()
+
+
+def occurrences_to_matrix(occurrences, shape):
+    # duplicated pairs are summed, so each cell has a token count
+    return build_csr_matrix(
+        occurrences["row_id"].to_numpy(), occurrences["column_id"].to_numpy(), shape
+    )
+
+
 def tokens_to_document_term_matrix(
     df, id_column, token_column, vocabulary, id_to_row=None
 ):
@@ -35,27 +87,17 @@ def tokens_to_document_term_matrix(
     else:
         token_to_column = dict(vocabulary)
 
-    token_counts = defaultdict(Counter)
-
     if id_to_row is None:
         id_to_row = dict(zip(df[id_column], range(len(df))))
 
-    for i, (elem_id, elem_tokens) in enumerate(df[[id_column, token_column]].values):
-        if elem_id in id_to_row:
-            row_id = id_to_row[elem_id]
-        else:
-            continue
-
-        elem_tokens = filter(lambda x: x in token_to_column, elem_tokens)
+    # id_to_row may be a dict or a Series indexed by id
+    if not isinstance(id_to_row, pd.Series):
+        id_to_row = pd.Series(id_to_row, dtype=int)
 
-        token_counts[row_id].update(elem_tokens)
-    dtm = dok_matrix(
-        (max(id_to_row.values()) + 1, max(token_to_column.values()) + 1), dtype=int
+    occurrences = token_occurrences(
+        df, id_column, token_column, token_to_column, id_to_row
     )
 
-    for row_id, elem_token_counts in token_counts.items():
-        for token, token_count in elem_token_counts.items():
-            column_id = token_to_column[token]
-            dtm[row_id, column_id] = token_count
-
-    return dtm.tocsr()
+    return occurrences_to_matrix(
+        occurrences, (id_to_row.max() + 1, max(token_to_column.values()) + 1)
+    )
@@ -1,4 +1,7 @@
 import gzip
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 import rapidjson as json
 import toml
@@ -12,10 +15,21 @@ from tsundoku.utils.dates import date_from_filename
 
 def write_parquet(obj, filename):
     df = pa.Table.from_pandas(obj)
-    pq.write_table(df, filename, use_dictionary=False)
+    write_table(df, filename)
     return
 
 
+def write_table(table, filename, use_dictionary=False):
+    # zstd compresses better than the default (snappy) at a similar speed
+    pq.write_table(
+        table,
+        filename,
+        use_dictionary=use_dictionary,
+        compression="zstd",
+        compression_level=3,
+    )
+
+
 def read_file(filename, encoding="utf-8"):
     with open(filename, "rt", encoding=encoding) as f:
         return f.read().strip()
@@ -25,6 +39,39 @@ def read_list(filename, encoding="utf-8"):
     return read_file(filename, encoding=encoding).split("\n")
 
 
+def file_size(filename):
+    # a single stat call, -1 when the file does not exist
+    try:
+        return os.stat(filename).st_size
+    except FileNotFoundError:
+        return -1
+
+
+def read_bytes(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def prefetch_files(filenames, n_ahead=4):
+    """
+    Yields (filename, contents) pairs in order. The next n_ahead files are read in
+    background threads while the caller processes the current one.
+    """
+    with ThreadPoolExecutor(max_workers=n_ahead) as pool:
+        pending = deque()
+
+        for filename in filenames:
+            pending.append((filename, pool.submit(read_bytes, filename)))
+
+            if len(pending) > n_ahead:
+                current, contents = pending.popleft()
+                yield current, contents.result()
+
+        while pending:
+            current, contents = pending.popleft()
+            yield current, contents.result()
+
+
 def read_json(filename):
     filename = str(filename)
     if filename.endswith("gz"):
@@ -1,21 +1,23 @@
 import sys
-import rapidjson as json
+import orjson
 
 from tsundoku.utils.tweets import flatten_tweet
 
 
 def iterate_tweets(src, encoding="utf-8"):
     seen_tweets = set()
+    # orjson parses UTF-8 bytes directly, other encodings need to be transcoded
+    transcode = encoding.lower().replace("-", "") != "utf8"
 
     for l in src:
         try:
-            line = l.decode(encoding)  # .encode('utf-8')
+            line = l.decode(encoding).encode("utf-8") if transcode else l
             # print(line)
             # raise Exception()
-            if not line.startswith("{"):
+            if not line.startswith(b"{"):
                 continue
 
-            tweet = json.loads(line)
+            tweet = orjson.loads(line)
 
             if type(tweet) == dict and "user" in tweet:
                 if tweet["id"] in seen_tweets:
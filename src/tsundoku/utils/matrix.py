@@ -1,21 +1,48 @@
-import dask.dataframe as dd
+import numpy as np
+import pandas as pd
 from scipy.sparse import load_npz
 
 
+def load_csr_matrix(filename, dtype=None):
+    matrix = load_npz(filename)
+
+    if dtype is not None and matrix.dtype != dtype:
+        matrix = matrix.astype(dtype)
+
+    # 32-bit indices are enough unless a dimension or nnz overflows them
+    if hasattr(matrix, "indptr") and max(matrix.shape) < 2**31 and matrix.nnz < 2**31:
+        matrix.indices = matrix.indices.astype(np.int32, copy=False)
+        matrix.indptr = matrix.indptr.astype(np.int32, copy=False)
+
+    return matrix
+
+
 def load_matrix_and_features(
-    data_path, matrix_key, names_key, name, index="token", token_id="token_id"
+    data_path,
+    matrix_key,
+    names_key,
+    name,
+    index="token",
+    token_id="token_id",
+    columns=None,
+    dtype=np.float32,
 ):
     if not names_key.endswith("parquet"):
         names_key = f"{names_key}.relevant.parquet"
 
-    raw_matrix = load_npz(data_path / f"{matrix_key}.matrix.npz")
-    raw_features = dd.read_parquet(data_path / names_key)
+    if columns is not None:
+        columns = list(dict.fromkeys([index, token_id, *columns]))
 
-    if index != "token":
-        raw_features = raw_features.rename(columns={index: "token"})
+    # matrices stacked with scipy.sparse.hstack should share a dtype, otherwise
+    # the result is silently widened with a copy of every stored value
+    raw_matrix = load_csr_matrix(data_path / f"{matrix_key}.matrix.npz", dtype=dtype)
+    # the vocabulary fits in memory; pyarrow reads it with its threaded reader
+    raw_features = pd.read_parquet(data_path / names_key, columns=columns)
+    raw_features = raw_features.rename(columns={index: "token", token_id: "token_id"})
 
-    if token_id != "token_id":
-        raw_features = raw_features.rename(columns={token_id: "token_id"})
+    # keep string tokens in a contiguous arrow array instead of python objects
+    if raw_features["token"].dtype == object:
+        raw_features["token"] = raw_features["token"].astype("string[pyarrow]")
 
     raw_features["type"] = name
 
@@ -25,10 +52,7 @@ def load_matrix_and_features(
     return raw_matrix, raw_features
 
 
-def load_raw_matrix(
-    data_path,
-    matrix_key,
-):
-    raw_matrix = load_npz(data_path / f"{matrix_key}.matrix.npz")
+def load_raw_matrix(data_path, matrix_key, dtype=np.float32):
+    raw_matrix = load_csr_matrix(data_path / f"{matrix_key}.matrix.npz", dtype=dtype)
     print(repr(raw_matrix))
     return raw_matrix
@@ -0,0 +1,119 @@
+import re
+
+import pandas as pd
+import pytest
+
+from tsundoku.data.importer import TweetImporter, is_re2_compatible
+
+LOCATIONS = [
+    "Ñuñoa, Chile",
+    "ñuñoa",
+    "Ñuñoeño",
+    "Valparaíso",
+    "VALPARAÍSO, CL",
+    "Concepción",
+    "Santiago de Chile",
+    "São Paulo",
+    "Chile 🇨🇱",
+    "",
+    None,
+]
+
+
+def make_importer(tmp_path, gazetteer, blacklist=None):
+    (tmp_path / "gazetteer.txt").write_text("\n".join(gazetteer), encoding="utf-8")
+    location = 'gazetteers = ["gazetteer.txt"]\naccept_unknown = 0\n'
+
+    if blacklist is not None:
+        (tmp_path / "blacklist.txt").write_text("\n".join(blacklist), encoding="utf-8")
+        location += 'blacklist = ["blacklist.txt"]\n'
+
+    config = tmp_path / "config.toml"
+    config.write_text(
+        "[project]\n"
+        'name = "test"\n'
+        "[project.path]\n"
+        f'config = "{tmp_path.as_posix()}"\n'
+        f'data = "{tmp_path.as_posix()}"\n'
+        "[project.content]\n"
+        'timezone = "America/Santiago"\n'
+        "[project.environment]\n"
+        "n_jobs = 1\n"
+        "[project.content.location]\n" + location,
+        encoding="utf-8",
+    )
+    return TweetImporter(str(config))
+
+
+def write_tweets(tmp_path):
+    tweets = pd.DataFrame(
+        {
+            "id": range(len(LOCATIONS)),
+            "user.id": range(100, 100 + len(LOCATIONS)),
+            "user.location": LOCATIONS,
+            "text": "hola",
+        }
+    )
+    filename = tmp_path / "tweets.parquet"
+    tweets.to_parquet(filename)
+    return filename
+
+
+def expected_ids(gazetteer, blacklist=None):
+    # what Python's re accepts, the reference for every matching path
+    accepted = re.compile("|".join(gazetteer), re.IGNORECASE)
+    rejected = re.compile("|".join(blacklist), re.IGNORECASE) if blacklist else None
+
+    return {
+        i
+        for i, location in enumerate(LOCATIONS)
+        if location is not None
+        and accepted.search(location)
+        and not (rejected and rejected.search(location))
+    }
+
+
+def accepted_ids(importer, filename, engine=None):
+    if engine is not None:
+        importer.location["engines"] = dict.fromkeys(
+            importer.location["engines"], engine
+        )
+        importer.location["filter"] = importer.location_filter()
+
+    return set(importer.read_tweet_dataframe(filename)["id"])
+
+
+@pytest.mark.parametrize(
+    "pattern", [r"\bñuñoa\b", r"\w+paraíso", r"chile\s", r"\Bñoa", r"\d"]
+)
+def test_unicode_sensitive_escapes_are_not_re2_compatible(pattern):
+    assert not is_re2_compatible(pattern)
+
+
+@pytest.mark.parametrize(
+    "gazetteer,blacklist,engines",
+    [
+        (["ñuñoa", "valparaíso"], None, {"patterns": "automaton"}),
+        (
+            ["ÑUÑOA", "concepci.n"],
+            ["ñuñoeño"],
+            {"patterns": "arrow", "blacklist": "automaton"},
+        ),
+        ([r"^ñuñoa", "são"], None, {"patterns": "arrow"}),
+        ([r"\bñuñoa\b", r"valpara\w+"], None, {"patterns": "pandas"}),
+        (["chile"], [r"\bñuñoa\b"], {"patterns": "automaton", "blacklist": "pandas"}),
+    ],
+)
+def test_location_engines_accept_the_same_rows(tmp_path, gazetteer, blacklist, engines):
+    filename = write_tweets(tmp_path)
+    importer = make_importer(tmp_path, gazetteer, blacklist)
+    expected = expected_ids(gazetteer, blacklist)
+
+    assert importer.location["engines"] == engines
+    assert accepted_ids(importer, filename) == expected
+
+    # Python's re can express every list, and RE2 every list that avoided pandas
+    assert accepted_ids(importer, filename, "pandas") == expected
+
+    if "pandas" not in engines.values():
+        assert accepted_ids(importer, filename, "arrow") == expected